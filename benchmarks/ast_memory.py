@@ -0,0 +1,35 @@
+"""Measure the memory used by parsed programs, per KB of source code.
+
+Compares the default parser with the compact one, which interns atoms in a
+constant pool.
+"""
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from lispy import *
+
+
+FUNCTION = '(defun area-{i} (r) (let ((pi 3.1415926535)) (if (> r 0) (* pi (pow r 2)) (write "Invalid radius {i}"))))'
+
+
+def measure(parser, tokens):
+    tracemalloc.start()
+    instruction = parser.parse(tokens)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return size
+
+
+if __name__ == '__main__':
+    for functions in [100, 300, 1000]:
+        source = '(progn {})'.format(' '.join(FUNCTION.format(i=i) for i in range(functions)))
+        tokens = Lexer().tokenize(source)
+        kilobytes = len(source) / 1024
+
+        for name, parser in [('default', Parser()), ('compact', Parser(compact=True))]:
+            size = measure(parser, tokens)
+            print('{:>6} functions, {}: {:.0f} bytes per source KB'.format(functions, name, size / kilobytes))
@@ -0,0 +1,43 @@
+"""Compare dispatching on a value with case against the equivalent nested if.
+
+The case form looks up the clause in a table built the first time it is
+evaluated, while the nested if compares the value with each key in turn.
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from lispy import *
+
+
+def nested_if(keys):
+    code = 'nil'
+    for key in reversed(range(keys)):
+        code = '(if (= x {0}) {0} {1})'.format(key, code)
+    return '(defun dispatch (x) {})'.format(code)
+
+
+def case(keys):
+    clauses = ' '.join('({0} {0})'.format(key) for key in range(keys))
+    return '(defun dispatch (x) (case x {}))'.format(clauses)
+
+
+def measure(definition, keys, calls=200):
+    lispy = Lispy()
+    lispy.eval(definition)
+    values = [keys * i // calls for i in range(calls)]
+
+    start = time.perf_counter()
+    for value in values:
+        lispy.eval('(dispatch {})'.format(value))
+    return (time.perf_counter() - start) / calls
+
+
+if __name__ == '__main__':
+    for keys in [10, 100, 300]:
+        chained = measure(nested_if(keys), keys)
+        hashed = measure(case(keys), keys)
+        print('{:>4} keys: nested if {:>8.1f}us, case {:>6.1f}us per call'.format(
+            keys, chained * 1e6, hashed * 1e6))
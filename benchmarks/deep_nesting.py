@@ -0,0 +1,43 @@
+"""Measure the lexer and the parser on deeply nested input.
+
+Both keep nested lists in an explicit stack, so the nesting depth is only
+limited by memory.
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from lispy import *
+
+
+FUNCTION = '(defun area-{i} (r) (let ((pi 3.1415926535)) (if (> r 0) (* pi (pow r 2)) (write "Invalid radius {i}"))))'
+
+
+def measure(source, repetitions):
+    lexer = Lexer()
+    parser = Parser()
+
+    start = time.perf_counter()
+    for _ in range(repetitions):
+        tokens = lexer.tokenize(source)
+    tokenize = (time.perf_counter() - start) / repetitions
+
+    start = time.perf_counter()
+    for _ in range(repetitions):
+        parser.parse(tokens)
+    parse = (time.perf_counter() - start) / repetitions
+
+    return tokenize, parse
+
+
+if __name__ == '__main__':
+    for depth, repetitions in [(10, 1000), (1000, 20), (100000, 1)]:
+        source = '(list ' * depth + '1' + ')' * depth
+        tokenize, parse = measure(source, repetitions)
+        print('depth {:>6}: tokenize {:>10.1f}us, parse {:>10.1f}us'.format(depth, tokenize * 1e6, parse * 1e6))
+
+    source = '(progn {})'.format(' '.join(FUNCTION.format(i=i) for i in range(100)))
+    tokenize, parse = measure(source, 20)
+    print('100 functions: tokenize {:>10.1f}us, parse {:>10.1f}us'.format(tokenize * 1e6, parse * 1e6))
@@ -0,0 +1,53 @@
+"""Measure hash-consed lists on data with many duplicated subtrees.
+
+Compares the memory used by the parsed data, the time to compare two equal
+quoted lists, and the time to use lists as hash table keys.
+"""
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from lispy import *
+
+
+SUBTREE = '((name "point") (coordinates (1 2 3)) (tags (red green blue)))'
+
+
+def measure_memory(parser, tokens):
+    tracemalloc.start()
+    instruction = parser.parse(tokens)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return size
+
+
+def measure_time(lispy, source, repetitions):
+    start = time.perf_counter()
+    for _ in range(repetitions):
+        lispy.eval(source)
+    return (time.perf_counter() - start) / repetitions
+
+
+if __name__ == '__main__':
+    for copies in [100, 1000, 3000]:
+        data = '(quote ({}))'.format(' '.join([SUBTREE] * copies))
+        tokens = Lexer().tokenize(data)
+
+        for name, hash_cons in [('default', False), ('hash-consed', True)]:
+            size = measure_memory(Parser(hash_cons=hash_cons), tokens)
+
+            lispy = Lispy(hash_cons=hash_cons)
+            lispy.eval('(set x {})'.format(data))
+            lispy.eval('(set y {})'.format(data))
+            lispy.eval('(set table (make-hash))')
+            lispy.eval('(puthash (get x) 1 (get table))')
+
+            equal = measure_time(lispy, '(= (get x) (get y))', 100)
+            lookup = measure_time(lispy, '(gethash (get y) (get table))', 100)
+
+            print('{:>5} copies, {:>11}: {:>8.0f} KB, equality {:>8.1f}us, lookup {:>8.1f}us'.format(
+                copies, name, size / 1024, equal * 1e6, lookup * 1e6))
@@ -0,0 +1,43 @@
+"""Count with the native loop forms and with the equivalent recursion.
+
+Recursion goes through `defun` and `let`, so it is limited by Python's
+recursion depth and only runs for small counts.
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from lispy import *
+
+
+PROGRAMS = {
+    'dotimes': '(let ((total 0)) (dotimes (i {n}) (setq total (+ total 1))) total)',
+    'while': '(let ((i 0)) (while (< i {n}) (setq i (+ i 1))) i)',
+    'recursion': '(progn (defun count-to (i) (if (= i {n}) i (count-to (+ i 1)))) (count-to 0))',
+}
+
+
+def run(program, n):
+    lispy = Lispy()
+    start = time.perf_counter()
+    result = lispy.eval(program.format(n=n))
+    elapsed = time.perf_counter() - start
+
+    assert result == n
+    return elapsed
+
+
+if __name__ == '__main__':
+    sys.setrecursionlimit(100000)
+
+    for n in [1000, 5000]:
+        for name, program in PROGRAMS.items():
+            elapsed = run(program, n)
+            print('{:>9} {:>8}: {:.2f}us per iteration'.format(name, n, elapsed / n * 1e6))
+
+    for name in ['dotimes']:
+        n = 10000000
+        elapsed = run(PROGRAMS[name], n)
+        print('{:>9} {:>8}: {:.2f}s'.format(name, n, elapsed))
@@ -0,0 +1,40 @@
+"""Measure the creation of interpreters for short-lived sandboxes.
+
+Compares loading a library into each new interpreter with creating the
+interpreters from a shared environment where it is already loaded.
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from lispy import *
+
+
+FUNCTION = '(defun area-{i} (r) (let ((pi 3.1415926535)) (if (> r 0) (* pi (pow r 2)) (write "Invalid radius {i}"))))'
+
+
+def load_library(lispy, functions):
+    for i in range(functions):
+        lispy.eval(FUNCTION.format(i=i))
+    return lispy
+
+
+def measure(create, repetitions):
+    start = time.perf_counter()
+    for _ in range(repetitions):
+        create()
+    return (time.perf_counter() - start) / repetitions
+
+
+if __name__ == '__main__':
+    print('empty interpreter: {:.1f}us'.format(measure(Interpreter, 10000) * 1e6))
+
+    for functions in [10, 100, 1000]:
+        environment = load_library(Lispy(), functions).environment()
+
+        reload = measure(lambda: load_library(Lispy(), functions), 5)
+        shared = measure(lambda: Lispy(environment=environment), 1000)
+        print('{:>5} functions: reloading {:>10.1f}us, shared environment {:>6.1f}us'.format(
+            functions, reload * 1e6, shared * 1e6))
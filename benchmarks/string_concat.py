@@ -0,0 +1,38 @@
+"""Build a string one piece at a time with `concat` and `write` it.
+
+Concatenation is backed by ropes, so the running time should grow linearly
+with the size of the output.
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from lispy import *
+
+
+PIECE = '0123456789'
+
+
+def build(size):
+    lispy = Lispy()
+    lispy.eval('(set acc "")')
+    instruction = lispy.parser.parse(lispy.lexer.tokenize('(set acc (concat (get acc) "{}"))'.format(PIECE)))
+
+    pieces = size // len(PIECE)
+
+    start = time.perf_counter()
+    for _ in range(pieces):
+        lispy.interpreter.execute(instruction)
+    result = lispy.eval('(get acc)').value
+    elapsed = time.perf_counter() - start
+
+    assert len(result) == pieces * len(PIECE)
+    return elapsed
+
+
+if __name__ == '__main__':
+    for megabytes in [1, 2, 5, 10]:
+        elapsed = build(megabytes * 1024 * 1024)
+        print('{:>3} MB: {:.2f}s'.format(megabytes, elapsed))
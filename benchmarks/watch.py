@@ -0,0 +1,48 @@
+"""Measure the time to evaluate a script again after changing one function.
+
+Compares running the whole script with the watch mode, which only evaluates
+the changed forms and the forms depending on them.
+"""
+import io
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from lispy import *
+
+
+FUNCTION = '(defun area-{i} (r) (let ((pi {pi})) (if (> r 0) (* pi (pow r 2)) (write "Invalid radius {i}"))))'
+
+
+def write_script(filename, functions, pi):
+    with open(filename, 'w') as fd:
+        for i in range(functions):
+            fd.write(FUNCTION.format(i=i, pi=pi if i == 0 else 3.14) + '\n')
+        fd.write('(write (area-0 2))\n')
+
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, 'script.lisp')
+
+        for functions in [100, 1000, 5000]:
+            write_script(filename, functions, 3.14)
+            lispy = Lispy(output=OutputPort(io.StringIO()))
+            watcher = Watcher(lispy, filename)
+            watcher.update()
+
+            write_script(filename, functions, 3.1415)
+
+            start = time.perf_counter()
+            Lispy(output=OutputPort(io.StringIO())).execute_script(filename)
+            full = time.perf_counter() - start
+
+            start = time.perf_counter()
+            evaluated = watcher.update()
+            incremental = time.perf_counter() - start
+
+            print('{:>5} functions: full run {:>8.1f}ms, watch {:>6.1f}ms ({} forms evaluated)'.format(
+                functions, full * 1000, incremental * 1000, evaluated))
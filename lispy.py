@@ -1,15 +1,31 @@
 __version__ = '0.0.1'
 
 import argparse
+import asyncio
+import atexit
+import bisect
+import collections
+import functools
+import gc
+import io
+import itertools
+import operator
+import os
 import re
 import readline
+import sys
+import threading
+import time
+import tracemalloc
+import types
+import weakref
 
 
 class LispyError(BaseException): pass
 
 
 class Lispy:
-    def __init__(self):
+    def __init__(self, output=None, metrics=None, compact=False, hash_cons=False, environment=None):
         # REPL attributes
         self.prompt = '>>> '
         self.welcome_message = ''
@@ -17,13 +33,65 @@ class Lispy:
 
         # Interpreter attributes
         self.lexer = Lexer()
-        self.parser = Parser()
-        self.interpreter = Interpreter()
+        self.parser = Parser(compact=compact, hash_cons=hash_cons)
+        self.interpreter = Interpreter(output=output, environment=environment)
+
+        # Metrics attributes
+        self.metrics = Metrics() if metrics is True else metrics
+
+    def eval(self, string, max_steps=None, max_depth=None, max_list_size=None, timeout=None):
+        if self.metrics is not None:
+            return self._eval_with_metrics(string, Budget(max_steps, max_depth, max_list_size, timeout))
 
-    def eval(self, string):
         tokens = self.lexer.tokenize(string)
         instruction = self.parser.parse(tokens)
-        return self.interpreter.execute(instruction)
+
+        if max_steps is None and max_depth is None and max_list_size is None and timeout is None:
+            return self.interpreter.execute(instruction)
+
+        budget = Budget(max_steps, max_depth, max_list_size, timeout)
+        return self.interpreter.run(instruction, budget)
+
+    def _eval_with_metrics(self, string, budget):
+        metrics = self.metrics
+
+        start = time.perf_counter()
+        tokens = self.lexer.tokenize(string)
+        end = time.perf_counter()
+        metrics.observe('tokenize', end - start)
+
+        start = end
+        instruction = self.parser.parse(tokens)
+        end = time.perf_counter()
+        metrics.observe('parse', end - start)
+
+        start = end
+        try:
+            return self.interpreter.run(instruction, budget)
+        finally:
+            metrics.observe('execute', time.perf_counter() - start)
+            metrics.record(budget)
+
+    def environment(self):
+        return self.interpreter.environment()
+
+    def stats(self):
+        if self.metrics is None:
+            return None
+        return self.metrics.stats()
+
+    def memory_stats(self):
+        return self.interpreter.memory_stats()
+
+    def alloc_trace(self, string, sites=None):
+        traces = []
+
+        for form in self.split_forms(string):
+            instruction = self.parser.parse(self.lexer.tokenize(form))
+            result, trace = self.interpreter.trace_allocations(instruction, sites=sites is not None)
+            traces.append(dict(trace.stats(sites), form=form, result=result))
+
+        return traces
 
     def repl(self):
         readline.parse_and_bind('tab: complete')
@@ -34,8 +102,10 @@ class Lispy:
             try:
                 string = self._read_input()
                 output = self.eval(string)
+                self.interpreter.output.flush()
                 print(self._format_output(output))
             except LispyError as e:
+                self.interpreter.output.flush()
                 print('ERROR: {}'.format(str(e)))
             except (KeyboardInterrupt, EOFError):
                 break
@@ -73,25 +143,335 @@ class Lispy:
 
     def execute_script(self, filename):
         with open(filename) as fd:
-            string = fd.read().replace('\n', '')
+            string = fd.read()
+
+        for form in self.split_forms(string):
+            self.eval(form)
+
+        self.run_tasks()
+        self.interpreter.output.flush()
+
+    def split_forms(self, string):
+        string = string.replace('\n', '')
+
+        # Forms start at parentheses found outside any form, and end at the
+        # ones closing them
+        depth = 0
+        start = end = 0
+        for match in re.finditer(r'[()]', string):
+            if match.group() == '(':
+                if depth == 0:
+                    yield from self._split_characters(string[end:match.start()])
+                    start = match.start()
+                depth += 1
+            elif depth > 0:
+                depth -= 1
+                if depth == 0:
+                    end = match.end()
+                    yield string[start:end]
+
+        # An unterminated form is left for the parser to reject
+        if depth > 0:
+            yield string[start:]
+        else:
+            yield from self._split_characters(string[end:])
 
-        buffer = []
-        open_parentheses = 0
+    def _split_characters(self, string):
+        # Outside parentheses, each character is a form of its own
+        if string and not string.isspace():
+            yield from (c for c in string if not c.isspace())
+
+    def watch(self, filename, interval=0.5):
+        watcher = Watcher(self, filename)
+
+        try:
+            while True:
+                start = time.perf_counter()
+                evaluated = watcher.poll()
+
+                if evaluated is not None:
+                    elapsed = time.perf_counter() - start
+                    print('{} of {} forms evaluated in {:.1f}ms'.format(evaluated, len(watcher.forms), elapsed * 1000), file=sys.stderr)
+
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            pass
+
+    def run_tasks(self):
+        if self.interpreter.scheduler is not None:
+            self.interpreter.scheduler.run()
+
+    def map_lines(self, function_name, input=None, output=None, flush_every=1000, chunk_size=1024 * 1024):
+        input = input or sys.stdin
+        output = OutputPort(output) if output is not None else self.interpreter.output
+        function_name = Symbol(function_name)
+
+        remainder = ''
+        count = 0
+
+        while True:
+            chunk = input.read(chunk_size)
+            if not chunk:
+                break
+
+            lines = (remainder + chunk).split('\n')
+            remainder = lines.pop()
+
+            for line in lines:
+                self._map_line(function_name, line, output)
+
+                count += 1
+                if count % flush_every == 0:
+                    output.flush()
+
+        if remainder:
+            self._map_line(function_name, remainder, output)
+            count += 1
+
+        output.flush()
+        return count
+
+    def _map_line(self, function_name, line, output):
+        result = self.interpreter.call(function_name, [String(line)])
+
+        # Returning nil drops the line
+        if result.__class__ != Nil:
+            output.write(str(result) + '\n')
+
+
+class OutputPort:
+    def __init__(self, sink=None, buffer_size=64 * 1024):
+        self.sink = sink
+        self.buffer_size = buffer_size
+        self._buffer = []
+        self._buffer_length = 0
+        self._lock = threading.Lock()
+        _output_ports.add(self)
+
+    def write(self, string):
+        with self._lock:
+            self._buffer.append(string)
+            self._buffer_length += len(string)
+            full = self._buffer_length >= self.buffer_size
+
+        if full:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            if not self._buffer:
+                return
+
+            string = ''.join(self._buffer)
+            self._buffer.clear()
+            self._buffer_length = 0
+
+            # The standard output is looked up on every flush, so that
+            # redirecting sys.stdout also redirects ports created before it
+            sink = self.sink if self.sink is not None else sys.stdout
+
+            if hasattr(sink, 'write'):
+                sink.write(string)
+                sink.flush()
+            else:
+                sink(string)
+
+
+_output_ports = weakref.WeakSet()
+
+
+@atexit.register
+def _flush_output_ports():
+    for output_port in list(_output_ports):
+        output_port.flush()
+
+class Budget:
+    class LimitExceededError(LispyError): pass
+    class StepLimitExceededError(LimitExceededError): pass
+    class DepthLimitExceededError(LimitExceededError): pass
+    class ListSizeLimitExceededError(LimitExceededError): pass
+    class TimeoutError(LimitExceededError): pass
 
-        for c in string:
-            if c == '(':
-                open_parentheses += 1
-            elif c == ')':
-                open_parentheses -= 1
+    # The clock is only read once every this many steps
+    deadline_check_interval = 1024
 
-            buffer.append(c)
+    def __init__(self, max_steps=None, max_depth=None, max_list_size=None, timeout=None):
+        self.max_steps = max_steps
+        self.max_depth = max_depth
+        self.max_list_size = max_list_size
+        self.deadline = time.monotonic() + timeout if timeout is not None else None
+        self.steps = 0
+        self.calls = 0
+        self.peak_depth = 0
 
-            if open_parentheses == 0:
-                self.eval(''.join(buffer))
-                buffer = []
+    def step(self):
+        self.steps += 1
+
+        if self.max_steps is not None and self.steps > self.max_steps:
+            raise self.StepLimitExceededError('Exceeded maximum of {} evaluation steps'.format(self.max_steps))
+
+        if self.deadline is not None and self.steps % self.deadline_check_interval == 0:
+            self.check_deadline()
+
+    def check_deadline(self):
+        if time.monotonic() > self.deadline:
+            raise self.TimeoutError('Exceeded evaluation deadline')
+
+    def check_depth(self, depth):
+        if depth > self.peak_depth:
+            self.peak_depth = depth
+
+        if self.max_depth is not None and depth > self.max_depth:
+            raise self.DepthLimitExceededError('Exceeded maximum depth of {}'.format(self.max_depth))
+
+    def check_list_size(self, size):
+        if self.max_list_size is not None and size > self.max_list_size:
+            raise self.ListSizeLimitExceededError('Exceeded maximum list size of {}'.format(self.max_list_size))
+
+
+class Metrics:
+    stages = ('tokenize', 'parse', 'execute')
+
+    # Upper bounds of the latency histogram buckets, in seconds
+    buckets = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.counts = {stage: 0 for stage in self.stages}
+        self.seconds = {stage: 0.0 for stage in self.stages}
+        # The last bucket counts the observations above all bounds
+        self.histograms = {stage: [0] * (len(self.buckets) + 1) for stage in self.stages}
+        self.forms = 0
+        self.user_function_calls = 0
+        self.peak_depth = 0
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            self.counts[stage] += 1
+            self.seconds[stage] += seconds
+            self.histograms[stage][bisect.bisect_left(self.buckets, seconds)] += 1
+
+    def record(self, budget):
+        with self._lock:
+            self.forms += budget.steps
+            self.user_function_calls += budget.calls
+            self.peak_depth = max(self.peak_depth, budget.peak_depth)
+
+    def stats(self):
+        return {
+            'stages': {
+                stage: {
+                    'count': self.counts[stage],
+                    'seconds': self.seconds[stage],
+                    'histogram': dict(zip(self.buckets + (float('inf'),), self.histograms[stage])),
+                }
+                for stage in self.stages
+            },
+            'forms': self.forms,
+            'user_function_calls': self.user_function_calls,
+            'peak_depth': self.peak_depth,
+        }
+
+    def export(self):
+        lines = [
+            '# HELP lispy_stage_duration_seconds Time spent in each stage of an evaluation',
+            '# TYPE lispy_stage_duration_seconds histogram',
+        ]
+
+        for stage in self.stages:
+            total = 0
+            for bound, count in zip(self.buckets + (float('inf'),), self.histograms[stage]):
+                total += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append('lispy_stage_duration_seconds_bucket{{stage="{}",le="{}"}} {}'.format(stage, le, total))
+            lines.append('lispy_stage_duration_seconds_sum{{stage="{}"}} {!r}'.format(stage, self.seconds[stage]))
+            lines.append('lispy_stage_duration_seconds_count{{stage="{}"}} {}'.format(stage, self.counts[stage]))
+
+        lines += [
+            '# HELP lispy_forms_evaluated_total Forms evaluated',
+            '# TYPE lispy_forms_evaluated_total counter',
+            'lispy_forms_evaluated_total {}'.format(self.forms),
+            '# HELP lispy_user_function_calls_total Calls to user defined functions',
+            '# TYPE lispy_user_function_calls_total counter',
+            'lispy_user_function_calls_total {}'.format(self.user_function_calls),
+            '# HELP lispy_peak_scope_depth Deepest nesting of local variable contexts',
+            '# TYPE lispy_peak_scope_depth gauge',
+            'lispy_peak_scope_depth {}'.format(self.peak_depth),
+        ]
+        return '\n'.join(lines) + '\n'
+
+    def write(self, filename):
+        # Scrapers never see a partially written file
+        temporary_filename = filename + '.tmp'
+        with open(temporary_filename, 'w') as fd:
+            fd.write(self.export())
+        os.replace(temporary_filename, filename)
+
+
+class AllocationTrace:
+    # Memory allocated while evaluating a form, measured with tracemalloc.
+    # The size is the memory the form leaves allocated and the peak the most
+    # it had allocated at once. Allocations made by other threads meanwhile
+    # are counted too
+    def __init__(self, sites=False):
+        self.size = 0
+        self.peak = 0
+
+        # Memory left allocated by each user function, without the functions
+        # it calls, and its number of calls
+        self.sites = {} if sites else None
+        self._callees_size = 0
+
+    def __enter__(self):
+        self._started = not tracemalloc.is_tracing()
+        if self._started:
+            tracemalloc.start()
+
+        tracemalloc.reset_peak()
+        self._start = tracemalloc.get_traced_memory()[0]
+        return self
+
+    def __exit__(self, *exc_info):
+        current, peak = tracemalloc.get_traced_memory()
+        self.size = current - self._start
+        self.peak = peak - self._start
+
+        if self._started:
+            tracemalloc.stop()
+
+    def call(self, function, interpreter, values):
+        start = tracemalloc.get_traced_memory()[0]
+        callees_size, self._callees_size = self._callees_size, 0
+
+        try:
+            return function.apply(interpreter, values, traced=True)
+        finally:
+            size = tracemalloc.get_traced_memory()[0] - start
+
+            site = self.sites.get(function.name)
+            if site is None:
+                site = self.sites[function.name] = [0, 0]
+            site[0] += size - self._callees_size
+            site[1] += 1
+
+            self._callees_size = callees_size + size
+
+    def stats(self, top=None):
+        sites = sorted(self.sites.items(), key=lambda item: item[1][0], reverse=True) if self.sites is not None else []
+
+        return {
+            'size': self.size,
+            'peak': self.peak,
+            'sites': [{'function': name.value, 'size': size, 'calls': calls} for name, (size, calls) in sites[:top]],
+        }
 
 
 class Type:
+    __slots__ = ('value',)
+
     def __init__(self, value):
         self._assert_type(value)
         self.value = value
@@ -99,6 +479,9 @@ class Type:
     def __eq__(self, other):
         return self.value == other
 
+    def __hash__(self):
+        return hash(self.value)
+
     def __repr__(self):
         return str(self.value)
 
@@ -106,6 +489,8 @@ class Type:
         raise NotImplementedError('Types must implement "_assert_type" method')
 
 class Nil(Type):
+    __slots__ = ()
+
     def __init__(self):
         self.value = None
 
@@ -117,6 +502,8 @@ class Nil(Type):
 
 
 class T(Type):
+    __slots__ = ()
+
     def __init__(self):
         self.value = True
 
@@ -125,21 +512,75 @@ class T(Type):
 
 
 class Integer(Type):
+    __slots__ = ()
+
     def _assert_type(self, value):
         if type(value) != int:
             raise TypeError('Value "{}" is not an integer'.format(value))
 
 class Float(Type):
+    __slots__ = ()
+
     def _assert_type(self, value):
         if type(value) != float:
             raise TypeError('Value "{}" is not a float'.format(value))
 
 class String(Type):
+    __slots__ = ('_value', '_pieces')
+
+    def __init__(self, value):
+        self._assert_type(value)
+        self._value = value
+        self._pieces = None
+
+    @classmethod
+    def concat(cls, *strings):
+        # Ropes make concatenation O(1): the new string only references its
+        # pieces and the text is flattened once, when the value is needed.
+        for string in strings:
+            if string.__class__ != cls:
+                raise TypeError('Value "{}" is not a string'.format(string))
+
+        if len(strings) == 1:
+            return strings[0]
+
+        result = cls('')
+        result._value = None
+        result._pieces = strings
+        return result
+
+    @property
+    def value(self):
+        if self._value is None:
+            self._value = self._flatten()
+            self._pieces = None
+        return self._value
+
+    def _flatten(self):
+        chunks = []
+        stack = [self]
+
+        while stack:
+            string = stack.pop()
+
+            # The pieces are read before the value, as another thread may be
+            # flattening the same rope and only drops them once it is done
+            pieces = string._pieces
+
+            if pieces is None:
+                chunks.append(string._value)
+            else:
+                stack.extend(reversed(pieces))
+
+        return ''.join(chunks)
+
     def _assert_type(self, value):
         if type(value) != str:
             raise TypeError('Value "{}" is not a string'.format(value))
 
 class Symbol(Type):
+    __slots__ = ()
+
     def __eq__(self, other):
         return other.__class__ == self.__class__ and self.value == other.value
 
@@ -147,7 +588,7 @@ class Symbol(Type):
         return other.__class__ != self.__class__ or self.value != other.value
 
     def __hash__(self):
-        return hash(self.__class__.__name__ + self.value)
+        return hash(self.value)
 
     def __repr__(self):
         return ':{}'.format(self.value)
@@ -157,9 +598,13 @@ class Symbol(Type):
             raise TypeError('Value "{}" is not a symbol'.format(value))
 
 class List(Type):
+    # Hash-consed lists cache their hash, any other list has it set to None
+    __slots__ = ('_hash',)
+
     def __init__(self, *elements):
         [self._assert_type(element) for element in elements]
         self.value = list(elements)
+        self._hash = None
 
     def __getitem__(self, i):
         if i.__class__ == slice:
@@ -168,6 +613,9 @@ class List(Type):
         return self.value[i]
 
     def __setitem__(self, i, value):
+        if self._hash is not None:
+            raise TypeError('Hash-consed lists are immutable')
+
         self._assert_type(value)
         self.value[i] = value
 
@@ -177,6 +625,22 @@ class List(Type):
     def __iter__(self):
         return (v for v in self.value)
 
+    def __eq__(self, other):
+        if self is other:
+            return True
+
+        # Equal lists have equal hashes, so hash-consed lists with different
+        # hashes are never equal
+        if self._hash is not None and other.__class__ == List and other._hash is not None and self._hash != other._hash:
+            return False
+
+        return self.value == other
+
+    def __hash__(self):
+        if self._hash is not None:
+            return self._hash
+        return hash(tuple(self.value))
+
     def __repr__(self):
         return '(' + ' '.join([str(v) for v in self.value]) + ')'
 
@@ -184,10 +648,313 @@ class List(Type):
         if not isinstance(value, Type):
             raise TypeError('Value "{}" is not a valid type'.format(value))
 
+class HashKey:
+    # Keys of hash tables are compared with their types, so that 1, 1.0 and
+    # t are different keys, also inside lists
+    __slots__ = ('key', '_hash')
+
+    def __init__(self, key):
+        self.key = key
+        self._hash = hash(key)
+
+    def __eq__(self, other):
+        if other.__class__ != HashKey:
+            return self.key == other
+        return self._same(self.key, other.key)
+
+    def __hash__(self):
+        return self._hash
+
+    def __repr__(self):
+        return repr(self.key)
+
+    @classmethod
+    def _same(cls, x, y):
+        if x is y:
+            return True
+
+        if x.__class__ != y.__class__ or x != y:
+            return False
+
+        if x.__class__ == List:
+            return all(cls._same(a, b) for a, b in zip(x.value, y.value))
+
+        return True
+
+
+class HashTable(Type):
+    __slots__ = ()
+
+    def __init__(self, value=None):
+        value = {} if value is None else value
+        self._assert_type(value)
+
+        # Read-only tables are views of tables whose keys are already wrapped
+        if type(value) == dict:
+            value = {key if key.__class__ == HashKey else HashKey(key): item for key, item in value.items()}
+
+        self.value = value
+
+    # Hash tables are mutable, so they cannot be used as keys
+    __hash__ = None
+
+    def __repr__(self):
+        return '#hash(' + ' '.join(['({} {})'.format(k, v) for k, v in self.value.items()]) + ')'
+
+    def _assert_type(self, value):
+        if type(value) not in (dict, types.MappingProxyType):
+            raise TypeError('Value "{}" is not a dict'.format(value))
+        for key, item in value.items():
+            if key.__class__ == HashKey:
+                key = key.key
+            if not isinstance(key, Type) or not isinstance(item, Type):
+                raise TypeError('Value "{}" is not a valid type'.format(item))
+
+class Stream(Type):
+    __slots__ = ('_realized', '_head', '_tail')
+
+    def __init__(self, value):
+        self._assert_type(value)
+        self.value = value
+        self._realized = False
+        self._head = None
+        self._tail = None
+
+    def __eq__(self, other):
+        return self is other
+
+    def __hash__(self):
+        return id(self)
+
+    def __iter__(self):
+        # Streams are traversed only once, except for the elements already
+        # realized by `first` and `rest`
+        if not self._realized:
+            return self.value
+        if self._head is None:
+            return iter(())
+        return itertools.chain([self._head], self._tail)
+
+    def __repr__(self):
+        return '#stream'
+
+    def first(self):
+        self._realize()
+        return self._head
+
+    def rest(self):
+        self._realize()
+        return self._tail
+
+    def _realize(self):
+        if not self._realized:
+            self._head = next(self.value, None)
+            self._tail = Stream(self.value)
+            self._realized = True
+
+    def _assert_type(self, value):
+        if not hasattr(value, '__next__'):
+            raise TypeError('Value "{}" is not an iterator'.format(value))
+
+class File(Type):
+    __slots__ = ()
+
+    def __eq__(self, other):
+        return self is other
+
+    def __hash__(self):
+        return id(self)
+
+    def __repr__(self):
+        return '#file({})'.format(self.value.name)
+
+    def _assert_type(self, value):
+        if not isinstance(value, io.IOBase):
+            raise TypeError('Value "{}" is not a file'.format(value))
+
+class Lambda(Type):
+    __slots__ = ('arg_names', 'instructions')
+
+    def __init__(self, arg_names, instructions, closure):
+        self._assert_type(closure)
+        self.value = closure
+        self.arg_names = arg_names
+        self.instructions = instructions
+
+    def __eq__(self, other):
+        return self is other
+
+    def __hash__(self):
+        return id(self)
+
+    def __repr__(self):
+        return '#lambda'
+
+    def _assert_type(self, value):
+        if type(value) != dict:
+            raise TypeError('Value "{}" is not a closure'.format(value))
+
+class Task(Type):
+    __slots__ = ('args', 'budget', 'thread', 'wakeup', 'awaiting', 'resumed_value', 'blocked', 'finished', 'error')
+
+    def __init__(self, function, args, budget=None):
+        self.value = function
+        self.args = args
+        self.budget = budget
+        self.thread = None
+        self.wakeup = threading.Semaphore(0)
+        self.awaiting = None
+        self.resumed_value = None
+        self.blocked = None
+        self.finished = False
+        self.error = None
+
+    def __eq__(self, other):
+        return self is other
+
+    def __hash__(self):
+        return id(self)
+
+    def __repr__(self):
+        return '#task'
+
+
+class Channel(Type):
+    __slots__ = ()
+
+    def __eq__(self, other):
+        return self is other
+
+    def __hash__(self):
+        return id(self)
+
+    def __repr__(self):
+        return '#channel'
+
+    def _assert_type(self, value):
+        if not isinstance(value, asyncio.Queue):
+            raise TypeError('Value "{}" is not a queue'.format(value))
+
+
+class Watcher:
+    class Form:
+        __slots__ = ('key', 'instruction', 'defines', 'uses')
+
+        def __init__(self, key, instruction, defines, uses):
+            self.key = key
+            self.instruction = instruction
+            self.defines = defines
+            self.uses = uses
+
+    definitions = (Symbol('defun'), Symbol('set'), Symbol('setq'))
+
+    def __init__(self, lispy, filename):
+        self.lispy = lispy
+        self.filename = filename
+        self.forms = []
+        self.mtime = None
+
+        # Parsed forms by content, so that unchanged forms are not parsed again
+        self.cache = {}
+
+    def poll(self):
+        mtime = os.stat(self.filename).st_mtime_ns
+
+        if mtime == self.mtime:
+            return None
+
+        self.mtime = mtime
+        return self.update()
+
+    def update(self):
+        with open(self.filename) as fd:
+            sources = list(self.lispy.split_forms(fd.read()))
+
+        previous = collections.Counter(form.key for form in self.forms)
+        previous_names = set().union(*[form.defines for form in self.forms])
+
+        forms = [self._form(source) for source in sources]
+        changed = set()
+
+        for i, form in enumerate(forms):
+            if previous[form.key] > 0:
+                previous[form.key] -= 1
+            else:
+                changed.add(i)
+
+        # Definitions removed from the script are removed from the
+        # interpreter, and forms using them evaluated again
+        names = set().union(*[form.defines for form in forms])
+        removed = previous_names - names
+        for name in removed:
+            self.lispy.interpreter._undefine(name)
+
+        self.forms = forms
+        evaluate = self._dependents(changed, removed)
+
+        for i in sorted(evaluate):
+            try:
+                self.lispy.interpreter.execute(forms[i].instruction)
+            except LispyError as e:
+                self.lispy.interpreter.output.flush()
+                print('ERROR: {}'.format(str(e)))
+
+        self.lispy.run_tasks()
+        self.lispy.interpreter.output.flush()
+        return len(evaluate)
+
+    def _form(self, source):
+        key = source.strip()
+        form = self.cache.get(key)
+
+        if form is None:
+            instruction = self.lispy.parser.parse(self.lispy.lexer.tokenize(key))
+            defines = set()
+
+            if instruction.__class__ == List and len(instruction) > 1 and instruction[0] in self.definitions:
+                defines.add(instruction[1])
+
+            form = self.cache[key] = self.Form(key, instruction, defines, self._symbols(instruction) - defines)
+
+        return form
+
+    def _symbols(self, instruction):
+        symbols = set()
+        stack = [instruction]
+
+        while stack:
+            element = stack.pop()
+
+            if element.__class__ == List:
+                stack.extend(element.value)
+            elif element.__class__ == Symbol:
+                symbols.add(element)
+
+        return symbols
+
+    def _dependents(self, changed, names):
+        # Forms using a name defined by an evaluated form are evaluated too,
+        # as well as the forms using the names they define
+        evaluate = set(changed)
+        names = set(names).union(*[self.forms[i].defines for i in changed])
+
+        while True:
+            dependents = [i for i, form in enumerate(self.forms) if i not in evaluate and not names.isdisjoint(form.uses)]
+
+            if not dependents:
+                return evaluate
+
+            for i in dependents:
+                evaluate.add(i)
+                names |= self.forms[i].defines
+
 
 class Lexer:
     class InvalidInputError(LispyError): pass
 
+    # Parentheses, string literals (which may be unterminated) and words
+    token_regex = re.compile(r'[()]|"[^"]*"?|[^ ()"][^ ()]*')
+
     def tokenize(self, string):
         if not string:
             return []
@@ -195,86 +962,88 @@ class Lexer:
         string = string.replace('\n', ' ')
 
         if string[0] == '(':
-            return self.tokenize_list(list(string))
+            return self.tokenize_list(string)
         else:
-            return self.tokenize_words(list(string))
-
-    def tokenize_list(self, chars):
-        result = []
-        char = chars.pop(0) # ignore first '('
-
-        while chars:
-            char = chars.pop(0)
-
-            if char == ')':
-                return result
-            elif char == '(':
-                chars.insert(0, char)
-                result.append(self.tokenize_list(chars))
+            return self.tokenize_words(string)
+
+    def tokenize_list(self, string):
+        # Nested lists are kept in an explicit stack instead of the Python
+        # one, so that the nesting depth is only limited by memory
+        root = []
+        stack = [root]
+
+        for token in self.token_regex.findall(string):
+            if token == '(':
+                child = []
+                stack[-1].append(child)
+                stack.append(child)
+            elif token == ')':
+                stack.pop()
+
+                if len(stack) == 1:
+                    return root[0]
             else:
-                chars.insert(0, char)
-                result += self.tokenize_words(chars)
+                stack[-1].append(token)
 
-        raise self.InvalidInputError('Invalid input "{}"'.format(''.join(chars)))
+        raise self.InvalidInputError('Invalid input "{}"'.format(string))
 
-    def tokenize_words(self, chars):
-        words_delimiters = '()'
-        words_ignores = ' '
-        literal_delimiters = '"'
+    def tokenize_words(self, string):
         result = []
 
-        while chars:
-            char = chars.pop(0)
+        for match in self.token_regex.finditer(string):
+            token = match.group()
 
-            if char in words_delimiters:
-                chars.insert(0, char)
+            if token in ('(', ')'):
                 break
-            elif char in words_ignores:
-                continue
-            elif char in literal_delimiters:
-                chars.insert(0, char)
-                result.append(self.tokenize_literal(chars))
-            else:
-                chars.insert(0, char)
-                result.append(self.tokenize_word(chars))
+            result.append(token)
 
         return result
 
-    def tokenize_word(self, chars):
-        word_delimiters = ' ()'
-        result = []
 
-        while chars:
-            char = chars.pop(0)
+class BoundedCache(dict):
+    # A cache that drops its oldest half when it is full, so that caches
+    # filled by every form evaluated do not grow for as long as the process
+    # lives. Only writes take the lock, as reads are single dict operations
+    def __init__(self, max_size):
+        super().__init__()
+        self.max_size = max_size
+        self._lock = threading.Lock()
 
-            if char in word_delimiters:
-                chars.insert(0, char)
-                break
-            else:
-                result.append(char)
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._evict()
+            super().__setitem__(key, value)
 
-        return ''.join(result)
+    def setdefault(self, key, value):
+        with self._lock:
+            if key in self:
+                return self[key]
 
-    def tokenize_literal(self, chars):
-        literal_delimiters = '"'
-        result = []
-        char = chars.pop(0) # ignore first '"'
-        result.append(char)
+            self._evict()
+            super().__setitem__(key, value)
+            return value
 
-        while chars:
-            char = chars.pop(0)
+    def _evict(self):
+        if len(self) >= self.max_size:
+            for key in list(itertools.islice(self, len(self) // 2)):
+                del self[key]
 
-            if char in literal_delimiters:
-                result.append(char)
-                break
-            else:
-                result.append(char)
 
-        return ''.join(result)
+class Parser:
+    # Maximum number of atoms and lists interned
+    max_interned = 100000
+
+    def __init__(self, compact=False, hash_cons=False):
+        # In compact mode, atoms are interned in a constant pool, so that
+        # repeated tokens share a single object
+        self.compact = compact or hash_cons
+        self.constants = BoundedCache(self.max_interned)
 
+        # In hash-consing mode, lists are interned too, so that identical
+        # subtrees share a single immutable object with a cached hash
+        self.hash_cons = hash_cons
+        self.lists = BoundedCache(self.max_interned)
 
-class Parser:
-    def __init__(self):
         self.type_parser = {
             'nil': {
                 'regex': r'^(nil)$',
@@ -298,101 +1067,628 @@ class Parser:
             },
         }
         self.types = self.type_parser.keys()
+        self.matchers = [(re.compile(self.type_parser[type]['regex']).match, self.type_parser[type]['parser']) for type in self.types]
 
     def parse(self, tokens):
         if not tokens:
             return Nil()
 
-        result = []
+        # Each frame holds the remaining tokens of a list and its parsed
+        # elements, so that the nesting depth is only limited by memory
+        stack = [(iter(tokens), [])]
+        parse_token = self._parse_token
 
-        for token in tokens:
-            if type(token) == list:
-                result.append(self.parse(token))
+        while True:
+            remaining, result = stack[-1]
+
+            for token in remaining:
+                if type(token) != list:
+                    result.append(parse_token(token))
+                elif token:
+                    stack.append((iter(token), []))
+                    break
+                else:
+                    result.append(Nil())
             else:
-                result.append(self._parse_token(token))
+                stack.pop()
+                parsed = self._intern_list(result) if self.hash_cons else List(*result)
+
+                if not stack:
+                    return parsed
+                stack[-1][1].append(parsed)
 
-        return List(*result)
+    def _intern_list(self, elements):
+        # Atoms are compared with their classes, so that (1) and (1.0) are
+        # still different lists. Lists are already interned, so they are
+        # compared by identity, which also keeps their atoms apart. Their ids
+        # stay valid while the key is pooled, as the interned list holds them
+        key = tuple((List, id(element)) if element.__class__ == List else (element.__class__, element) for element in elements)
+        interned = self.lists.get(key)
+
+        if interned is None:
+            interned = List(*elements)
+            interned._hash = hash(tuple(elements))
+
+            # Another thread may have interned the same list meanwhile
+            interned = self.lists.setdefault(key, interned)
+
+        return interned
 
     def _parse_token(self, token):
-        for type in self.types:
-            regex = self.type_parser[type]['regex']
-            result = re.match(regex, token)
+        if self.compact:
+            constant = self.constants.get(token)
+
+            if constant is None:
+                constant = self.constants.setdefault(token, self._parse_atom(token))
+
+            return constant
+
+        return self._parse_atom(token)
+
+    def _parse_atom(self, token):
+        for match, parser in self.matchers:
+            result = match(token)
 
             if result:
-                parser = self.type_parser[type]['parser']
                 return parser(result.group(1))
 
         return Symbol(token)
 
 
-class Interpreter:
-    class UndefinedSymbolError(LispyError): pass
-    class UndefinedFunctionError(LispyError): pass
-    class UndefinedVariableError(LispyError): pass
+class UserFunction:
+    # User functions do not belong to an interpreter, so that interpreters
+    # created from the same environment share them
+    def __init__(self, name, arg_names, instructions):
+        self.name = name
+        self.arg_names = list(arg_names) if arg_names else []
+        self.instructions = instructions
+
+        # Type feedback
+        self.calls = 0
+        self.argument_types = {}
+        self.specialized = None
+        self.specialized_types = None
+        self.specialized_calls = 0
+        self.fallbacks = 0
+
+    def __call__(self, interpreter, *args):
+        return self.apply(interpreter, [interpreter._evaluate_if_list(a) for a in args])
+
+    def apply(self, interpreter, values, traced=False):
+        state = interpreter.state
+
+        # Traced calls come back here once their allocations are measured
+        if state.allocation_trace is not None and not traced:
+            return state.allocation_trace.call(self, interpreter, values)
+
+        self.calls += 1
+
+        if state.budget is not None:
+            state.budget.calls += 1
+
+        if self.specialized is not None:
+            if tuple(value.__class__ for value in values) == self.specialized_types:
+                self.specialized_calls += 1
+                return self.specialized(interpreter, values)
+            self.fallbacks += 1
+        elif self.argument_types is not None and interpreter.specialization_threshold is not None:
+            self._record_types(interpreter, values)
+
+        var_defs = zip(self.arg_names, values)
+        return interpreter._evaluate_in_local_context(var_defs, [self.instructions])
+
+    def copy(self):
+        return UserFunction(self.name, self.arg_names, self.instructions)
+
+    def _record_types(self, interpreter, values):
+        # Another thread may have specialized the function meanwhile
+        argument_types = self.argument_types
+        if argument_types is None:
+            return
+
+        types = tuple(value.__class__ for value in values)
+        argument_types[types] = argument_types.get(types, 0) + 1
+
+        if self.calls < interpreter.specialization_threshold:
+            return
+
+        # Only functions always called with the same argument types and with
+        # one value for each argument are specialized
+        if len(argument_types) == 1 and len(types) == len(self.arg_names):
+            self.specialized_types = types
+            self.specialized = Specializer(self, types, interpreter.functions).compile()
+        self.argument_types = None
+
+
+class Specializer:
+    arithmetic_operators = {
+        '+': operator.add,
+        '-': operator.sub,
+        '*': operator.mul,
+    }
+    comparison_operators = {
+        '=': operator.eq,
+        '<': operator.lt,
+        '>': operator.gt,
+        '<=': operator.le,
+        '>=': operator.ge,
+    }
+
+    def __init__(self, function, types, functions):
+        self.function = function
+        self.types = dict(zip(function.arg_names, types))
+        self.functions = functions
+
+    def compile(self):
+        arg_names = self.function.arg_names
+        body, _ = self._compile_element(self.function.instructions)
+
+        def specialized(interpreter, values):
+            interpreter._create_local_variable_context()
+            local_variable_context = interpreter.state.local_variable_contexts[0]
+
+            try:
+                for name, value in zip(arg_names, values):
+                    local_variable_context[name] = value
+                return body(interpreter, local_variable_context)
+            finally:
+                interpreter._delete_local_variable_context()
+
+        return specialized
+
+    # Each compiled element is a function of the interpreter and the local
+    # variable context of the call, returned with the type of its result or
+    # None if it is unknown
+    def _compile_element(self, element):
+        if element.__class__ == List:
+            return self._compile_form(element)
+        elif element.__class__ == Symbol and element in self.types:
+            return (lambda interpreter, local_variable_context: local_variable_context[element]), self.types[element]
+        elif element.__class__ == Symbol:
+            return self._compile_generic(element), None
+        return self._compile_constant(element), element.__class__
+
+    def _compile_form(self, form):
+        function_name, *args = form.value
+
+        if function_name.__class__ != Symbol or function_name not in self.functions:
+            return self._compile_generic(form), None
+
+        function = self.functions[function_name]
+        is_builtin = function is Interpreter.regular_functions.get(function_name)
+
+        if is_builtin and function_name.value in self.arithmetic_operators and len(args) == 2:
+            return self._compile_arithmetic(function_name, function, args)
+
+        if is_builtin and function_name.value in self.comparison_operators and len(args) == 2:
+            return self._compile_comparison(function_name, function, args)
+
+        if function is Interpreter.special_functions.get(Symbol('if')) and len(args) in (2, 3):
+            return self._compile_if(*args), None
+
+        if function.__class__ == UserFunction:
+            return self._compile_call(function_name, args), None
+
+        return self._compile_generic(form), None
+
+    def _compile_constant(self, value):
+        return lambda interpreter, local_variable_context: value
+
+    def _compile_generic(self, element):
+        return lambda interpreter, local_variable_context: interpreter._evaluate_element(element)
 
+    def _compile_arithmetic(self, function_name, function, args):
+        (x, x_type), (y, y_type) = [self._compile_element(arg) for arg in args]
+
+        if x_type not in (Integer, Float) or y_type not in (Integer, Float):
+            return self._compile_binary(function, x, y), None
+
+        output_class = Integer if x_type == y_type == Integer else Float
+        operation = self.arithmetic_operators[function_name.value]
+        return self._compile_guarded_binary(function, operation, output_class, x, x_type, y, y_type), output_class
+
+    def _compile_comparison(self, function_name, function, args):
+        (x, x_type), (y, y_type) = [self._compile_element(arg) for arg in args]
+
+        if x_type not in (Integer, Float) or y_type not in (Integer, Float):
+            return self._compile_binary(function, x, y), None
+
+        operation = self.comparison_operators[function_name.value]
+        output_class = lambda result: T() if result else Nil()
+        return self._compile_guarded_binary(function, operation, output_class, x, x_type, y, y_type), None
+
+    def _compile_binary(self, function, x, y):
+        def binary(interpreter, local_variable_context):
+            budget = interpreter.state.budget
+            if budget is not None:
+                budget.step()
+            return function(interpreter, x(interpreter, local_variable_context), y(interpreter, local_variable_context))
+
+        return binary
+
+    def _compile_guarded_binary(self, function, operation, output_class, x, x_type, y, y_type):
+        specialized_function = self.function
+
+        def guarded_binary(interpreter, local_variable_context):
+            budget = interpreter.state.budget
+            if budget is not None:
+                budget.step()
+
+            x_value = x(interpreter, local_variable_context)
+            y_value = y(interpreter, local_variable_context)
+
+            if x_value.__class__ is x_type and y_value.__class__ is y_type:
+                return output_class(operation(x_value.value, y_value.value))
+
+            specialized_function.fallbacks += 1
+            return function(interpreter, x_value, y_value)
+
+        return guarded_binary
+
+    def _compile_if(self, condition, true_expr, false_expr=Nil()):
+        # Conditions that are not lists are not evaluated, as in `_if`
+        if condition.__class__ == List:
+            condition, _ = self._compile_form(condition)
+        else:
+            condition = self._compile_constant(condition)
+
+        true_expr, _ = self._compile_element(true_expr)
+        false_expr, _ = self._compile_element(false_expr)
+
+        def if_(interpreter, local_variable_context):
+            budget = interpreter.state.budget
+            if budget is not None:
+                budget.step()
+
+            if condition(interpreter, local_variable_context).__class__ != Nil:
+                return true_expr(interpreter, local_variable_context)
+            return false_expr(interpreter, local_variable_context)
+
+        return if_
+
+    def _compile_call(self, function_name, args):
+        form = List(function_name, *args)
+
+        # Arguments that are not lists are passed without evaluation, as in
+        # `UserFunction.__call__`
+        compiled_args = []
+        for arg in args:
+            if arg.__class__ == List:
+                compiled_args.append(self._compile_form(arg)[0])
+            else:
+                compiled_args.append(self._compile_constant(arg))
+
+        def call(interpreter, local_variable_context):
+            function = interpreter.functions.get(function_name)
+
+            if function.__class__ != UserFunction:
+                return interpreter.execute(form)
+
+            budget = interpreter.state.budget
+            if budget is not None:
+                budget.step()
+
+            result = function.apply(interpreter, [arg(interpreter, local_variable_context) for arg in compiled_args])
+            return result if result is not None else Nil()
+
+        return call
+
+
+class Environment:
+    # Functions and global variables shared by the interpreters created from
+    # it. Interpreters copy them before their first change, so the
+    # environment is never modified
+    def __init__(self, functions, global_variable_context=None):
+        self.functions = functions
+        self.global_variable_context = global_variable_context if global_variable_context is not None else {}
+
+
+class EvaluationState(threading.local):
+    # The state of the evaluations running in a thread. Interpreters keep
+    # one for each thread, so that threads evaluating on the same interpreter
+    # have their own scopes, budget and tasks
     def __init__(self):
-        self.global_variable_context = {}
         self.local_variable_contexts = []
+        self.lambda_depth = 0
+        self.budget = None
+        self.scheduler = None
+        self.allocation_trace = None
+
+
+class Scheduler:
+    class DeadlockError(LispyError): pass
+    class CancelledError(LispyError): pass
+
+    # Tasks run cooperatively on an asyncio event loop. Each task keeps its
+    # Python stack in a thread of its own, but only one of them runs at a
+    # time: the loop hands control to a task and waits until it finishes or
+    # suspends waiting for an awaitable, which the loop then awaits for it.
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+        self.loop = asyncio.new_event_loop()
+
+        # Schedulers are freed with the evaluation state of their thread, often
+        # in a reference cycle, so the loop is closed from a finalizer that
+        # keeps it alive until then
+        weakref.finalize(self, self.loop.close)
+
+        # Tasks not finished yet, with the futures driving them
+        self.tasks = {}
+        self.errors = []
+        self.current_task = None
+        self._suspended = threading.Semaphore(0)
+
+        # While the main thread waits, whether it needs a task to go on, and
+        # the future resolved when no task can
+        self.main_blocked = None
+        self.deadlock = None
+
+    def spawn(self, function, args, budget=None):
+        task = Task(function, args, budget)
+        self.tasks[task] = self.loop.create_task(self._drive(task))
+        return task
+
+    def wait(self, awaitable, blocked=None):
+        # Blocked waits pass a function telling whether they still need
+        # another task to complete, like a receive on an empty channel
+        task = self.current_task
+
+        if task is None:
+            return self._wait_main(awaitable, blocked)
+
+        task.awaiting = awaitable
+        task.blocked = blocked
+        self._suspended.release()
+        task.wakeup.acquire()
+
+        if task.error is not None:
+            raise task.error
+        return task.resumed_value
+
+    def cancel(self, budget):
+        # Called when an evaluation fails, so that the tasks it spawned do not
+        # go on against its exhausted budget
+        futures = [self.tasks.pop(task) for task in list(self.tasks) if task.budget is budget]
+
+        for future in futures:
+            future.cancel()
+
+        if futures:
+            self.loop.run_until_complete(asyncio.wait(futures))
+
+    def call(self, function):
+        # Blocking calls run in a thread of the executor of the loop, so that
+        # the other tasks go on meanwhile
+        return self.wait(self._call(function))
+
+    def run(self):
+        if self.tasks:
+            self._wait_main(self._join(), blocked=lambda: bool(self.tasks))
+
+    def _wait_main(self, awaitable, blocked):
+        if blocked is not None and not self.tasks:
+            awaitable.close()
+            raise self.DeadlockError('Waiting forever, there are no tasks to run')
+
+        self.main_blocked = blocked
+        try:
+            return self.loop.run_until_complete(self._watch(awaitable))
+        finally:
+            self.main_blocked = None
+            self._raise_errors()
+
+    async def _watch(self, awaitable):
+        future = asyncio.ensure_future(awaitable)
+        self.deadlock = self.loop.create_future()
+        self._check_deadlock()
+
+        try:
+            await asyncio.wait([future, self.deadlock], return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            self.deadlock = None
+
+        if not future.done():
+            future.cancel()
+            raise self.DeadlockError('All tasks are waiting on channels')
+        return future.result()
+
+    async def _call(self, function):
+        return await self.loop.run_in_executor(None, function)
+
+    async def _join(self):
+        # Tasks may spawn more tasks while they are awaited
+        while self.tasks:
+            await asyncio.wait(list(self.tasks.values()))
+
+    def _check_deadlock(self):
+        # Checked whenever a task blocks or finishes, or the main thread
+        # blocks, since only then can the last runnable task be gone
+        deadlock = self.deadlock
+        if deadlock is None or deadlock.done():
+            return
+
+        blocked = [self.main_blocked, *(task.blocked for task in self.tasks)]
+        if all(function is not None and function() for function in blocked):
+            deadlock.set_result(None)
+
+    async def _drive(self, task):
+        try:
+            while True:
+                self._resume(task)
+
+                if task.finished:
+                    del self.tasks[task]
+                    self._check_deadlock()
+                    return
+
+                if task.blocked is not None:
+                    self._check_deadlock()
+
+                try:
+                    task.resumed_value = await task.awaiting
+                except asyncio.CancelledError:
+                    raise
+                except BaseException as e:
+                    task.error = e
+                task.blocked = None
+        except asyncio.CancelledError:
+            self._unwind(task)
+            raise
+
+    def _unwind(self, task):
+        # The thread of a cancelled task is resumed with an error until its
+        # evaluation returns
+        if task.thread is None:
+            return
+
+        task.error = self.CancelledError('Task cancelled')
+        while not task.finished:
+            self._resume(task)
+
+    def _resume(self, task):
+        self.current_task = task
+
+        if task.thread is None:
+            task.thread = threading.Thread(target=self._run_task, args=[task], daemon=True)
+            task.thread.start()
+        else:
+            task.wakeup.release()
+
+        self._suspended.acquire()
+        self.current_task = None
+
+    def _run_task(self, task):
+        # The task thread starts with an evaluation state of its own, where
+        # the tasks it spawns run on this scheduler, and its steps count
+        # against the budget of the evaluation that spawned it
+        state = self.interpreter.state
+        state.scheduler = self
+        state.budget = task.budget
+
+        try:
+            self.interpreter.call(task.value, task.args)
+        except self.CancelledError:
+            pass
+        except BaseException as e:
+            self.errors.append(e)
+        finally:
+            task.finished = True
+            self._suspended.release()
+
+    def _raise_errors(self):
+        if self.errors:
+            error = self.errors[0]
+            self.errors.clear()
+            raise error
 
-        self.special_functions = {
-            Symbol('quote'): self._quote,
-            Symbol('defun'): self._defun,
-            Symbol('if'): self._if,
-            Symbol('let'): self._let,
-            Symbol('progn'): self._progn,
-            Symbol('set'): self._set,
-            Symbol('get'): self._get,
-        }
-        self.regular_functions = {
-            Symbol('list'): self._list,
-            Symbol('atom'): self._atom,
-            Symbol('car'): self._car,
-            Symbol('cdr'): self._cdr,
-            Symbol('cons'): self._cons,
-            Symbol('eq'): self._equal,
-            Symbol('='): self._equal,
-            Symbol('+'): self._sum,
-            Symbol('sum'): self._sum,
-            Symbol('-'): self._sub,
-            Symbol('sub'): self._sub,
-            Symbol('*'): self._mul,
-            Symbol('mul'): self._mul,
-            Symbol('/'): self._div,
-            Symbol('div'): self._div,
-            Symbol('pow'): self._pow,
-            Symbol('write'): self._write,
-            Symbol('read'): self._read,
-            Symbol('concat'): self._concat,
-            Symbol('float'): self._float,
-            Symbol('int'): self._int,
-            Symbol('str'): self._str,
-        }
-        self.functions = {**self.special_functions, **self.regular_functions}
+
+class Interpreter:
+    class UndefinedSymbolError(LispyError): pass
+    class UndefinedFunctionError(LispyError): pass
+    class UndefinedVariableError(LispyError): pass
+    class FileError(LispyError): pass
+    class ReadOnlyError(LispyError): pass
+    class UnsharableValueError(LispyError): pass
+
+    # Maximum number of case forms whose jump tables are kept
+    max_case_tables = 1000
+
+    def __init__(self, output=None, environment=None):
+        self.state = EvaluationState()
+        self.file_buffer_size = 1024 * 1024
+        self.output = output if output is not None else OutputPort()
+        self.specialization_threshold = 100
+
+        # Held while changing the functions and global variables, which are
+        # shared by all the threads evaluating on the interpreter
+        self.lock = threading.RLock()
+
+        # Jump tables of the latest case forms evaluated
+        self.case_tables = BoundedCache(self.max_case_tables)
+
+        environment = environment if environment is not None else self.builtins
+        self.functions = environment.functions
+        self.global_variable_context = environment.global_variable_context
+
+        # The functions and global variables of the environment are copied
+        # before they are first changed
+        self.shared_functions = True
+        self.shared_global_variables = environment is not self.builtins
+        if not self.shared_global_variables:
+            self.global_variable_context = {}
+
+    # The evaluation state of the current thread
+    @property
+    def local_variable_contexts(self):
+        return self.state.local_variable_contexts
+
+    @property
+    def lambda_depth(self):
+        # Number of local variable contexts hidden by lambda calls
+        return self.state.lambda_depth
+
+    @property
+    def budget(self):
+        return self.state.budget
+
+    @property
+    def scheduler(self):
+        # Created when the first task of the thread is spawned
+        return self.state.scheduler
+
+    def run(self, instruction, budget=None):
+        state = self.state
+        previous_budget = state.budget
+        state.budget = budget
+
+        try:
+            return self.execute(instruction)
+        except RecursionError:
+            self._cancel_tasks(budget)
+            if budget is None:
+                raise
+            raise Budget.DepthLimitExceededError('Exceeded maximum recursion depth')
+        except BaseException:
+            self._cancel_tasks(budget)
+            raise
+        finally:
+            state.budget = previous_budget
+
+    def _cancel_tasks(self, budget):
+        scheduler = self.state.scheduler
+        if budget is not None and scheduler is not None:
+            scheduler.cancel(budget)
 
     def execute(self, instruction):
-        if instruction.__class__ in [Symbol, Integer, Float, String]:
+        instruction_class = instruction.__class__
+
+        if instruction_class in (Symbol, Integer, Float, String):
             raise self.UndefinedSymbolError('Undefined symbol "{}"'.format(instruction))
 
-        if instruction == Nil():
+        if instruction_class == Nil:
             return Nil()
 
-        if instruction.__class__ == List:
-            function_name = instruction[0]
-            args = instruction[1:]
+        if instruction_class == List:
+            budget = self.state.budget
+            if budget is not None:
+                budget.step()
 
-            if function_name == Nil():
+            function_name, *args = instruction.value
+
+            if function_name.__class__ == Nil:
                 return Nil()
 
-            if function_name == T():
+            if function_name.__class__ == T:
                 return T()
 
             if function_name in self.regular_functions:
                 args = self._evaluate_elements(args)
 
-            if function_name in self.functions:
-                function = self.functions[function_name]
-                result = function(*args)
-                return result if result != None else Nil()
+            function = self.functions.get(function_name)
+
+            if function is not None:
+                result = function(self, *args)
+                return result if result is not None else Nil()
 
         raise self.UndefinedFunctionError('Undefined function "{}"'.format(function_name))
 
@@ -403,7 +1699,12 @@ class Interpreter:
         if element.__class__ == List:
             return self.execute(element)
         elif element.__class__ == Symbol:
-            return self._get_variable(element) if self._is_variable(element) else self.execute(element)
+            local_variable_context = self._find_local_variable_context(element)
+            if local_variable_context is not None:
+                return local_variable_context[element]
+            elif self._is_global_variable(element):
+                return self._get_global_variable(element)
+            return self.execute(element)
         else:
             return element
 
@@ -422,7 +1723,12 @@ class Interpreter:
         return self.global_variable_context[name]
 
     def _set_global_variable(self, name, value):
-        self.global_variable_context[name] = value
+        with self.lock:
+            if self.shared_global_variables:
+                self.global_variable_context = dict(self.global_variable_context)
+                self.shared_global_variables = False
+
+            self.global_variable_context[name] = value
 
     def _is_global_variable(self, name):
         return name in self.global_variable_context
@@ -434,26 +1740,53 @@ class Interpreter:
         raise self.UndefinedVariableError('Undefined local variable "{}"'.format(name))
 
     def _set_local_variable(self, name, value):
-        self.local_variable_contexts[0][name] = value
+        self.state.local_variable_contexts[0][name] = value
 
     def _is_local_variable(self, name):
         return self._find_local_variable_context(name) is not None
 
     def _find_local_variable_context(self, name):
-        for local_variable_context in self.local_variable_contexts:
+        for local_variable_context in self.state.local_variable_contexts:
             if name in local_variable_context:
                 return local_variable_context
         return None
 
     def _create_local_variable_context(self):
-        self.local_variable_contexts.insert(0, {})
+        state = self.state
+        if state.budget is not None:
+            state.budget.check_depth(state.lambda_depth + len(state.local_variable_contexts) + 1)
+        state.local_variable_contexts.insert(0, {})
 
     def _delete_local_variable_context(self):
-        self.local_variable_contexts.pop(0)
+        self.state.local_variable_contexts.pop(0)
 
     def _evaluate_if_list(self, param):
         return self.execute(param) if param.__class__ == List else param
 
+    def call(self, function_name, args):
+        budget = self.state.budget
+        if budget is not None:
+            budget.step()
+
+        if function_name.__class__ == Lambda:
+            return self._apply_lambda(function_name, args)
+
+        function = self.functions.get(function_name)
+
+        if function.__class__ == UserFunction:
+            result = function.apply(self, args)
+        elif function_name in self.regular_functions:
+            result = function(self, *args)
+        else:
+            raise self.UndefinedFunctionError('Undefined function "{}"'.format(function_name))
+
+        return result if result is not None else Nil()
+
+    def _iterate(self, sequence):
+        if sequence.__class__ == Nil:
+            return iter(())
+        return iter(sequence)
+
     # Functions
     def _quote(self, arg):
         return arg
@@ -461,19 +1794,28 @@ class Interpreter:
     def _list(self, *args):
         if not len(args):
             return Nil()
+        self._check_list_size(len(args))
         return List(*args)
 
     def _atom(self, value):
-        if value.__class__ == List:
+        if value.__class__ in (List, Stream):
             return Nil()
         return T()
 
     def _car(self, l):
+        if l.__class__ == Stream:
+            head = l.first()
+            return head if head is not None else Nil()
+
         if l.__class__ == Nil or len(l) < 1:
             return Nil()
         return l[0]
 
     def _cdr(self, l):
+        if l.__class__ == Stream:
+            tail = l.rest()
+            return tail if tail.first() is not None else Nil()
+
         if l.__class__ == Nil:
             return Nil()
 
@@ -487,8 +1829,14 @@ class Interpreter:
     def _cons(self, value, list):
         if not list:
             return List(value)
+        self._check_list_size(len(list) + 1)
         return List(value, *list)
 
+    def _check_list_size(self, size):
+        budget = self.state.budget
+        if budget is not None:
+            budget.check_list_size(size)
+
     def _set(self, name, value):
         self._set_global_variable(name, self._evaluate_if_list(value))
 
@@ -498,6 +1846,18 @@ class Interpreter:
     def _equal(self, x, y):
         return T() if x == y else Nil()
 
+    def _less(self, x, y):
+        return T() if x.value < y.value else Nil()
+
+    def _greater(self, x, y):
+        return T() if x.value > y.value else Nil()
+
+    def _less_equal(self, x, y):
+        return T() if x.value <= y.value else Nil()
+
+    def _greater_equal(self, x, y):
+        return T() if x.value >= y.value else Nil()
+
     def _sum(self, *args):
         output_class = self._cast_arithmetic_values(args)
         return output_class(sum([a.value for a in args]))
@@ -507,8 +1867,7 @@ class Interpreter:
             output_class = self._cast_arithmetic_values([x, y])
             result = output_class(x.value - y.value)
         else:
-            x.value *= -1
-            result = x
+            result = x.__class__(-x.value)
 
         return result
 
@@ -535,26 +1894,324 @@ class Interpreter:
         return output_class(x.value**y.value)
 
     def _let(self, var_defs, *instructions):
+        values = [(name, self._evaluate_element(value)) for name, value in var_defs or []]
+        return self._evaluate_in_local_context(values, instructions)
+
+    def _evaluate_in_local_context(self, var_defs, instructions):
         self._create_local_variable_context()
 
-        for name, value in var_defs:
-            self._set_local_variable(name, value)
+        try:
+            for name, value in var_defs:
+                self._set_local_variable(name, value)
 
-        result = Nil()
-        for instruction in instructions:
-            result = self._evaluate_element(instruction)
-        self._delete_local_variable_context()
+            result = Nil()
+            for instruction in instructions:
+                result = self._evaluate_element(instruction)
+        finally:
+            self._delete_local_variable_context()
 
         return result
 
     def _defun(self, function_name, arg_names, instructions):
-        def function(*arg_values):
-            values = [self._evaluate_if_list(a) for a in arg_values]
-            var_defs = zip(arg_names, values) if arg_names else []
-            return self._let(var_defs, instructions)
-        self.functions[function_name] = function
+        with self.lock:
+            if self.shared_functions:
+                self.functions = dict(self.functions)
+                self.shared_functions = False
+
+            # Specialized functions assume that built-in functions are not
+            # redefined, so they are replaced by unspecialized copies, which
+            # other interpreters sharing them do not see
+            if function_name in self.special_functions or function_name in self.regular_functions:
+                for name, function in self.functions.items():
+                    if function.__class__ == UserFunction:
+                        self.functions[name] = function.copy()
+
+            self.functions[function_name] = UserFunction(function_name, arg_names, instructions)
+
         return function_name
 
+    def _undefine(self, name):
+        with self.lock:
+            if name in self.functions and self.functions[name].__class__ == UserFunction:
+                if self.shared_functions:
+                    self.functions = dict(self.functions)
+                    self.shared_functions = False
+
+                if name in self.builtin_functions:
+                    self.functions[name] = self.builtin_functions[name]
+                else:
+                    del self.functions[name]
+
+            if name in self.global_variable_context:
+                if self.shared_global_variables:
+                    self.global_variable_context = dict(self.global_variable_context)
+                    self.shared_global_variables = False
+
+                del self.global_variable_context[name]
+
+    def environment(self):
+        # Hash tables are the only values changed in place, so the ones in
+        # the environment, including the ones captured by closures, are made
+        # read-only. Streams, files, channels and tasks change as they are used,
+        # so they cannot be shared at all
+        with self.lock:
+            frozen = {}
+            global_variable_context = {name: self._freeze(value, frozen) for name, value in self.global_variable_context.items()}
+            return Environment(dict(self.functions), global_variable_context)
+
+    def _freeze(self, value, frozen):
+        # Frozen values are registered before their items are frozen, so that
+        # values reachable through several paths, or from themselves, are
+        # frozen once
+        key = id(value)
+        if key in frozen:
+            return frozen[key]
+
+        if value.__class__ in (Stream, File, Channel, Task):
+            raise self.UnsharableValueError('Value "{}" cannot be shared by environments'.format(value))
+
+        if value.__class__ == HashTable:
+            items = {}
+            result = frozen[key] = HashTable(types.MappingProxyType(items))
+            items.update((key, self._freeze(item, frozen)) for key, item in value.value.items())
+            return result
+
+        if value.__class__ == Lambda:
+            closure = {}
+            result = frozen[key] = Lambda(value.arg_names, value.instructions, closure)
+            closure.update((name, self._freeze(item, frozen)) for name, item in value.value.items())
+            return result
+
+        if value.__class__ == List:
+            elements = [self._freeze(element, frozen) for element in value.value]
+            if any(element is not original for element, original in zip(elements, value.value)):
+                value = List(*elements)
+
+        frozen[key] = value
+        return value
+
+    def memory_stats(self):
+        # Values are not tracked by the interpreters creating them, so the
+        # ones alive in the whole process are counted
+        types = {type.__name__: 0 for type in Type.__subclasses__()}
+        for value in gc.get_objects():
+            if isinstance(value, Type):
+                types[value.__class__.__name__] = types.get(value.__class__.__name__, 0) + 1
+
+        functions = list(self.functions.values())
+
+        return {
+            'types': types,
+            'global_variables': len(self.global_variable_context),
+            'functions': len(functions),
+            'user_functions': sum(1 for function in functions if function.__class__ == UserFunction),
+        }
+
+    def trace_allocations(self, instruction, sites=False):
+        trace = AllocationTrace(sites)
+        state = self.state
+        previous_trace = state.allocation_trace
+
+        if sites:
+            state.allocation_trace = trace
+
+        try:
+            with trace:
+                result = self._evaluate_element(instruction)
+        finally:
+            state.allocation_trace = previous_trace
+
+        return result, trace
+
+    def specialization_stats(self):
+        return {
+            function.name.value: {
+                'calls': function.calls,
+                'specialized': function.specialized is not None,
+                'specialized_calls': function.specialized_calls,
+                'fallbacks': function.fallbacks,
+            }
+            for function in list(self.functions.values())
+            if function.__class__ == UserFunction
+        }
+
+    # Lambdas are closures over a copy of the local variables they use, so
+    # they are called with only their own variables in scope
+    def _lambda(self, arg_names, *instructions):
+        arg_names = list(arg_names) if arg_names else []
+        closure = {}
+
+        for name in self._free_variables(instructions, set(arg_names)):
+            local_variable_context = self._find_local_variable_context(name)
+            if local_variable_context is not None:
+                closure[name] = local_variable_context[name]
+
+        return Lambda(arg_names, instructions, closure)
+
+    def _free_variables(self, instructions, bound_variables):
+        free_variables = set()
+        elements = [(instruction, bound_variables) for instruction in instructions]
+
+        while elements:
+            element, bound_variables = elements.pop()
+
+            if element.__class__ == Symbol and element not in bound_variables:
+                free_variables.add(element)
+            elif element.__class__ == List and len(element):
+                function_name, *args = element.value
+
+                if function_name == Symbol('quote'):
+                    continue
+                elif function_name == Symbol('lambda') and args:
+                    inner_variables = bound_variables | set(args[0] or [])
+                    elements.extend((arg, inner_variables) for arg in args[1:])
+                elif function_name == Symbol('let') and args:
+                    var_defs = args[0] or []
+                    inner_variables = bound_variables | {var_def[0] for var_def in var_defs}
+                    elements.extend((var_def[1], bound_variables) for var_def in var_defs)
+                    elements.extend((arg, inner_variables) for arg in args[1:])
+                else:
+                    if function_name.__class__ != Symbol:
+                        elements.append((function_name, bound_variables))
+                    elements.extend((arg, bound_variables) for arg in args)
+
+        return free_variables
+
+    def _apply_lambda(self, function, values):
+        local_variable_context = dict(function.value)
+        local_variable_context.update(zip(function.arg_names, values))
+
+        state = self.state
+        local_variable_contexts = state.local_variable_contexts
+        state.lambda_depth += len(local_variable_contexts)
+        state.local_variable_contexts = []
+
+        try:
+            self._create_local_variable_context()
+            state.local_variable_contexts[0] = local_variable_context
+
+            result = Nil()
+            for instruction in function.instructions:
+                result = self._evaluate_element(instruction)
+            return result
+        finally:
+            state.local_variable_contexts = local_variable_contexts
+            state.lambda_depth -= len(local_variable_contexts)
+
+    def _funcall(self, function, *args):
+        return self.call(function, list(args))
+
+    def _apply(self, function, *args):
+        *values, sequence = args
+        return self.call(function, values + list(self._iterate(sequence)))
+
+    # Lists
+    def _map(self, function, *sequences):
+        call = self.call
+        if len(sequences) == 1:
+            return self._list(*self._bounded(call(function, [value]) for value in self._iterate(sequences[0])))
+        return self._list(*self._bounded(call(function, list(values)) for values in zip(*map(self._iterate, sequences))))
+
+    def _filter(self, function, sequence):
+        call = self.call
+        return self._list(*self._bounded(value for value in self._iterate(sequence) if call(function, [value]).__class__ != Nil))
+
+    def _sort(self, sequence, function=None):
+        values = list(self._bounded(self._iterate(sequence)))
+        self._check_list_size(len(values))
+
+        if function is None:
+            values.sort(key=lambda value: value.value)
+        else:
+            # Sorting only asks whether one value is less than the other, so
+            # the comparator is called once for each comparison
+            call = self.call
+            values.sort(key=functools.cmp_to_key(lambda x, y: -1 if call(function, [x, y]).__class__ != Nil else 0))
+
+        return self._list(*values)
+
+    def _length(self, sequence):
+        if sequence.__class__ in (List, String):
+            return Integer(len(sequence.value))
+        return Integer(sum(1 for _ in self._iterate(sequence)))
+
+    def _nth(self, index, sequence):
+        if sequence.__class__ == List:
+            return sequence.value[index.value] if 0 <= index.value < len(sequence.value) else Nil()
+        return next(itertools.islice(self._iterate(sequence), index.value, None), Nil())
+
+    def _reverse(self, sequence):
+        if sequence.__class__ == List:
+            return self._list(*reversed(sequence.value))
+        values = list(self._bounded(self._iterate(sequence)))
+        self._check_list_size(len(values))
+        return self._list(*reversed(values))
+
+    def _append(self, *sequences):
+        return self._list(*self._bounded(itertools.chain.from_iterable(map(self._iterate, sequences))))
+
+    # Tasks
+    def _spawn(self, function, *args):
+        state = self.state
+        if state.scheduler is None:
+            state.scheduler = Scheduler(self)
+        return state.scheduler.spawn(function, list(args), state.budget)
+
+    def _yield(self):
+        scheduler = self.state.scheduler
+        if scheduler is not None:
+            scheduler.wait(asyncio.sleep(0))
+        return Nil()
+
+    def _sleep(self, seconds):
+        seconds = seconds.value
+
+        # Sleeping past the deadline of the budget only waits until then
+        budget = self.state.budget
+        timed_out = False
+        if budget is not None and budget.deadline is not None:
+            remaining = max(budget.deadline - time.monotonic(), 0)
+            timed_out = seconds >= remaining
+            seconds = min(seconds, remaining)
+
+        scheduler = self.state.scheduler
+        if scheduler is None:
+            time.sleep(seconds)
+        else:
+            scheduler.wait(asyncio.sleep(seconds))
+
+        if timed_out:
+            raise Budget.TimeoutError('Exceeded evaluation deadline')
+        return Nil()
+
+    def _make_chan(self, capacity=Integer(0)):
+        return Channel(asyncio.Queue(capacity.value))
+
+    def _send(self, channel, value):
+        if channel.value.full():
+            self._wait_channel(channel.value.put(value), channel.value.full)
+        else:
+            channel.value.put_nowait(value)
+        return value
+
+    def _recv(self, channel):
+        if channel.value.empty():
+            return self._wait_channel(channel.value.get(), channel.value.empty)
+        return channel.value.get_nowait()
+
+    def _call_blocking(self, function):
+        scheduler = self.state.scheduler
+        if scheduler is None:
+            return function()
+        return scheduler.call(function)
+
+    def _wait_channel(self, awaitable, blocked):
+        scheduler = self.state.scheduler
+        if scheduler is None:
+            awaitable.close()
+            raise Scheduler.DeadlockError('Waiting forever, there are no tasks to run')
+        return scheduler.wait(awaitable, blocked)
+
     def _if(self, condition, true_expr, false_expr=Nil()):
         condition_result = self._evaluate_if_list(condition)
 
@@ -565,14 +2222,131 @@ class Interpreter:
 
         return result
 
+    def _cond(self, *clauses):
+        for clause in clauses:
+            test, *body = clause
+            result = self._evaluate_if_list(test)
+
+            if result != Nil():
+                return self._progn(*body) if body else result
+
+        return Nil()
+
+    def _case(self, key, *clauses):
+        table, default = self._case_table(clauses)
+        key = self._evaluate_element(key)
+        body = table.get((key.__class__, key), default)
+        return self._progn(*body)
+
+    def _case_table(self, clauses):
+        # Each case form is compiled once into a table from its keys to the
+        # bodies of their clauses, cached by its first clause
+        if not clauses:
+            return {}, ()
+
+        cached = self.case_tables.get(id(clauses[0]))
+        if cached is not None and cached[0] == clauses:
+            return cached[1]
+
+        table = {}
+        default = ()
+
+        for clause in clauses:
+            keys, *body = clause
+
+            if keys.__class__ == T or keys == Symbol('otherwise'):
+                default = body
+                break
+
+            for key in keys if keys.__class__ == List else [keys]:
+                table.setdefault((key.__class__, key), body)
+
+        self.case_tables[id(clauses[0])] = (clauses, (table, default))
+        return table, default
+
+    def _setq(self, name, value):
+        value = self._evaluate_element(value)
+        local_variable_context = self._find_local_variable_context(name)
+
+        if local_variable_context is not None:
+            local_variable_context[name] = value
+        else:
+            self._set_global_variable(name, value)
+
+        return value
+
+    # Loops run natively and reuse a single local variable context for all
+    # iterations
+    def _while(self, condition, *instructions):
+        budget = self.state.budget
+
+        while self._evaluate_element(condition) != Nil():
+            if budget is not None:
+                budget.step()
+            for instruction in instructions:
+                self._evaluate_element(instruction)
+
+        return Nil()
+
+    def _dotimes(self, var_def, *instructions):
+        name, count, *result = var_def
+        count = self._evaluate_element(count)
+
+        self._create_local_variable_context()
+        local_variable_context = self.state.local_variable_contexts[0]
+        budget = self.state.budget
+
+        try:
+            for i in range(count.value):
+                if budget is not None:
+                    budget.step()
+                local_variable_context[name] = Integer(i)
+                for instruction in instructions:
+                    self._evaluate_element(instruction)
+
+            local_variable_context[name] = count
+            return self._evaluate_element(result[0]) if result else Nil()
+        finally:
+            self._delete_local_variable_context()
+
+    def _dolist(self, var_def, *instructions):
+        name, values, *result = var_def
+        values = self._evaluate_element(values)
+
+        self._create_local_variable_context()
+        local_variable_context = self.state.local_variable_contexts[0]
+        budget = self.state.budget
+
+        try:
+            for value in values or []:
+                if budget is not None:
+                    budget.step()
+                local_variable_context[name] = value
+                for instruction in instructions:
+                    self._evaluate_element(instruction)
+
+            local_variable_context[name] = Nil()
+            return self._evaluate_element(result[0]) if result else Nil()
+        finally:
+            self._delete_local_variable_context()
+
     def _write(self, arg, end='\n'):
         if end == Nil():
             end = ''
-        print(arg, end=end)
+        self.output.write(str(arg) + str(end))
         return Nil()
 
     def _read(self):
-        return String(input())
+        self.output.flush()
+        return String(self._call_blocking(input))
+
+    def _flush(self, file=None):
+        if file is None:
+            self.output.flush()
+        else:
+            self._assert_open(file)
+            file.value.flush()
+        return Nil()
 
     def _progn(self, *instructions):
         result = Nil()
@@ -582,8 +2356,7 @@ class Interpreter:
         return result
 
     def _concat(self, *args):
-        strings = [arg.value for arg in args]
-        return String(''.join(strings))
+        return String.concat(*args)
 
     def _float(self, arg):
         return Float(float(arg.value))
@@ -594,14 +2367,279 @@ class Interpreter:
     def _str(self, arg):
         return String(str(arg.value))
 
+    def _make_hash(self):
+        return HashTable()
+
+    def _gethash(self, key, table, default=Nil()):
+        return table.value.get(HashKey(key), default)
+
+    def _puthash(self, key, value, table):
+        self._assert_writable(table)
+        table.value[HashKey(key)] = value
+        return value
+
+    def _remhash(self, key, table):
+        self._assert_writable(table)
+        key = HashKey(key)
+        if key not in table.value:
+            return Nil()
+        del table.value[key]
+        return T()
+
+    def _assert_writable(self, table):
+        if table.value.__class__ != dict:
+            raise self.ReadOnlyError('Hash table from a shared environment is read-only')
+
+    def _hash_keys(self, table):
+        return self._list(*(key.key for key in table.value))
+
+    def _hash_count(self, table):
+        return Integer(len(table.value))
+
+    # Lazy sequences
+    def _range(self, *args):
+        if not args:
+            return Stream(map(Integer, itertools.count()))
+        return Stream(map(Integer, range(*[arg.value for arg in args])))
+
+    def _lazy_map(self, function_name, sequence):
+        return Stream(self.call(function_name, [value]) for value in self._iterate(sequence))
+
+    def _lazy_filter(self, function_name, sequence):
+        return Stream(value for value in self._iterate(sequence) if self.call(function_name, [value]) != Nil())
+
+    def _take(self, count, sequence):
+        return Stream(itertools.islice(self._iterate(sequence), count.value))
+
+    def _reduce(self, function_name, sequence, *initial):
+        values = self._iterate(sequence)
+        result = initial[0] if initial else next(values, Nil())
+
+        for value in values:
+            result = self.call(function_name, [result, value])
+
+        return result
+
+    def _to_list(self, sequence):
+        return self._list(*self._bounded(self._iterate(sequence)))
+
+    def _bounded(self, values):
+        # Stop reading as soon as the list is too large, as the sequence may
+        # be infinite
+        budget = self.state.budget
+        if budget is not None and budget.max_list_size is not None:
+            return itertools.islice(values, budget.max_list_size + 1)
+        return values
+
+    # Files
+    def _open_file(self, path, mode=String('r')):
+        try:
+            return File(open(path.value, mode.value, buffering=self.file_buffer_size))
+        except (OSError, ValueError) as e:
+            raise self.FileError('Could not open file "{}": {}'.format(path, e))
+
+    def _read_line(self, file):
+        self._assert_open(file)
+        line = self._call_blocking(file.value.readline)
+
+        if not line:
+            return Nil()
+        return String(self._strip_newline(line))
+
+    def _read_lines(self, file):
+        self._assert_open(file)
+        return Stream(self._lines(file))
+
+    def _lines(self, file):
+        # Streams are read lazily, possibly after the file is closed, or
+        # from a task
+        try:
+            for line in iter(lambda: self._call_blocking(file.value.readline), ''):
+                yield String(self._strip_newline(line))
+        except ValueError:
+            self._assert_open(file)
+            raise
+
+    def _write_string(self, string, file=None):
+        if file is None:
+            self.output.write(string.value)
+        else:
+            self._assert_open(file)
+            file.value.write(string.value)
+        return Nil()
+
+    def _write_line(self, string, file=None):
+        self._write_string(string, file)
+        return self._write_string(String('\n'), file)
+
+    def _close(self, file):
+        file.value.close()
+        return Nil()
+
+    def _with_open_file(self, var_def, *instructions):
+        name, *args = var_def
+        file = self._open_file(*self._evaluate_elements(args))
+
+        self._create_local_variable_context()
+        self._set_local_variable(name, file)
+
+        try:
+            result = Nil()
+            for instruction in instructions:
+                result = self._evaluate_element(instruction)
+            return result
+        finally:
+            self._delete_local_variable_context()
+            file.value.close()
+
+    def _assert_open(self, file):
+        if file.value.closed:
+            raise self.FileError('File "{}" is closed'.format(file.value.name))
+
+    def _strip_newline(self, line):
+        return line[:-1] if line.endswith('\n') else line
+
+    # Memory
+    def _memory_stats(self):
+        stats = self.memory_stats()
+
+        return HashTable({
+            Symbol('types'): HashTable({Symbol(name): Integer(count) for name, count in stats['types'].items()}),
+            Symbol('global-variables'): Integer(stats['global_variables']),
+            Symbol('functions'): Integer(stats['functions']),
+            Symbol('user-functions'): Integer(stats['user_functions']),
+        })
+
+    def _alloc_trace(self, instruction, sites=None):
+        top = self._evaluate_element(sites).value if sites is not None else None
+        result, trace = self.trace_allocations(instruction, sites=top is not None)
+        stats = trace.stats(top)
+
+        self.output.write('{size} bytes retained, {peak} bytes at peak\n'.format(**stats))
+        for site in stats['sites']:
+            self.output.write('  {function}: {size} bytes retained in {calls} calls\n'.format(**site))
+
+        return result
+
+    special_functions = {
+        Symbol('quote'): _quote,
+        Symbol('defun'): _defun,
+        Symbol('if'): _if,
+        Symbol('let'): _let,
+        Symbol('progn'): _progn,
+        Symbol('set'): _set,
+        Symbol('get'): _get,
+        Symbol('setq'): _setq,
+        Symbol('while'): _while,
+        Symbol('dotimes'): _dotimes,
+        Symbol('dolist'): _dolist,
+        Symbol('with-open-file'): _with_open_file,
+        Symbol('lambda'): _lambda,
+        Symbol('cond'): _cond,
+        Symbol('case'): _case,
+        Symbol('alloc-trace'): _alloc_trace,
+    }
+    regular_functions = {
+        Symbol('list'): _list,
+        Symbol('atom'): _atom,
+        Symbol('car'): _car,
+        Symbol('cdr'): _cdr,
+        Symbol('cons'): _cons,
+        Symbol('eq'): _equal,
+        Symbol('='): _equal,
+        Symbol('<'): _less,
+        Symbol('>'): _greater,
+        Symbol('<='): _less_equal,
+        Symbol('>='): _greater_equal,
+        Symbol('+'): _sum,
+        Symbol('sum'): _sum,
+        Symbol('-'): _sub,
+        Symbol('sub'): _sub,
+        Symbol('*'): _mul,
+        Symbol('mul'): _mul,
+        Symbol('/'): _div,
+        Symbol('div'): _div,
+        Symbol('pow'): _pow,
+        Symbol('write'): _write,
+        Symbol('read'): _read,
+        Symbol('flush'): _flush,
+        Symbol('concat'): _concat,
+        Symbol('float'): _float,
+        Symbol('int'): _int,
+        Symbol('str'): _str,
+        Symbol('make-hash'): _make_hash,
+        Symbol('gethash'): _gethash,
+        Symbol('puthash'): _puthash,
+        Symbol('remhash'): _remhash,
+        Symbol('hash-keys'): _hash_keys,
+        Symbol('hash-count'): _hash_count,
+        Symbol('range'): _range,
+        Symbol('lazy-map'): _lazy_map,
+        Symbol('lazy-filter'): _lazy_filter,
+        Symbol('take'): _take,
+        Symbol('reduce'): _reduce,
+        Symbol('to-list'): _to_list,
+        Symbol('open-file'): _open_file,
+        Symbol('read-line'): _read_line,
+        Symbol('read-lines'): _read_lines,
+        Symbol('write-string'): _write_string,
+        Symbol('write-line'): _write_line,
+        Symbol('close'): _close,
+        Symbol('funcall'): _funcall,
+        Symbol('apply'): _apply,
+        Symbol('map'): _map,
+        Symbol('filter'): _filter,
+        Symbol('sort'): _sort,
+        Symbol('length'): _length,
+        Symbol('nth'): _nth,
+        Symbol('reverse'): _reverse,
+        Symbol('append'): _append,
+        Symbol('spawn'): _spawn,
+        Symbol('yield'): _yield,
+        Symbol('sleep'): _sleep,
+        Symbol('make-chan'): _make_chan,
+        Symbol('send'): _send,
+        Symbol('recv'): _recv,
+        Symbol('memory-stats'): _memory_stats,
+    }
+    builtin_functions = {**special_functions, **regular_functions}
+
+
+Interpreter.builtins = Environment(Interpreter.builtin_functions)
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='lispy v{}'.format(__version__))
     parser.add_argument('filename', nargs='?', help='program read from script file')
+    parser.add_argument('--map-lines', metavar='FUNC', help='call FUNC on each line read from the standard input')
+    parser.add_argument('--flush-every', metavar='N', type=int, default=1000, help='write the output of --map-lines every N lines')
+    parser.add_argument('--watch', action='store_true', help='evaluate the script again whenever it changes, only for changed forms and their dependents')
+    parser.add_argument('--metrics', metavar='FILE', help='write evaluation metrics to FILE at exit, in Prometheus text format')
     args = parser.parse_args()
 
-    if args.filename:
-        Lispy().execute_script(args.filename)
+    metrics = None
+    if args.metrics:
+        metrics = Metrics()
+        atexit.register(metrics.write, args.metrics)
+
+    if args.map_lines:
+        if not args.filename:
+            parser.error('--map-lines requires a script file')
+
+        lispy = Lispy(metrics=metrics)
+        lispy.execute_script(args.filename)
+
+        start = time.perf_counter()
+        count = lispy.map_lines(args.map_lines, flush_every=args.flush_every)
+        elapsed = time.perf_counter() - start
+
+        print('{} lines in {:.2f}s ({:.0f} lines/s)'.format(count, elapsed, count / elapsed if elapsed else 0), file=sys.stderr)
+    elif args.watch:
+        if not args.filename:
+            parser.error('--watch requires a script file')
+
+        Lispy(metrics=metrics).watch(args.filename)
+    elif args.filename:
+        Lispy(metrics=metrics).execute_script(args.filename)
     else:
         print('lispy v{}'.format(__version__))
-        Lispy().repl()
+        Lispy(metrics=metrics).repl()
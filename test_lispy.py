@@ -1,3 +1,9 @@
+import io
+import math
+import tempfile
+import threading
+import time
+import tracemalloc
 import unittest
 from unittest.mock import patch
 
@@ -125,6 +131,19 @@ class TestLispy(unittest.TestCase):
     def test_concat_with_variables(self):
         self.assertEqual(self.lispy.eval('(let ((x "abc")) (concat x "def"))'), String('abcdef'))
 
+    def test_concat_nested(self):
+        self.assertEqual(self.lispy.eval('(concat (concat "a" "b") (concat "c" "d"))'), String('abcd'))
+
+    def test_concat_result_is_reused(self):
+        self.lispy.eval('(set acc (concat "a" "b"))')
+        self.lispy.eval('(set x (concat (get acc) "c"))')
+        self.lispy.eval('(set y (concat (get acc) "d"))')
+        self.assertEqual(self.lispy.eval('(get x)'), String('abc'))
+        self.assertEqual(self.lispy.eval('(get y)'), String('abd'))
+
+    def test_str_of_concat(self):
+        self.assertEqual(self.lispy.eval('(int (concat "1" "2"))'), 12)
+
     def test_defun_return_atom(self):
         self.assertEqual(self.lispy.eval('(defun foo () 1)'), Symbol('foo'))
         self.assertEqual(self.lispy.eval('(foo)'), 1)
@@ -174,6 +193,70 @@ class TestLispy(unittest.TestCase):
     def test_if_with_parameter_evaluation(self):
         self.assertEqual(self.lispy.eval('(let ((x 1)) (if t x 2))'), 1)
 
+    def test_cond_first_true_clause(self):
+        self.assertEqual(self.lispy.eval('(cond ((= 1 2) 1) ((= 1 1) 2) (t 3))'), 2)
+
+    def test_cond_default_clause(self):
+        self.assertEqual(self.lispy.eval('(cond ((= 1 2) 1) (t 3))'), 3)
+
+    def test_cond_without_true_clause(self):
+        self.assertEqual(self.lispy.eval('(cond ((= 1 2) 1))'), Nil())
+
+    def test_cond_multiple_instructions(self):
+        self.assertEqual(self.lispy.eval('(cond (t (+ 1 2) (+ 3 4)))'), 7)
+
+    def test_cond_without_instructions(self):
+        self.assertEqual(self.lispy.eval('(cond ((+ 1 2)))'), 3)
+
+    def test_case_integer_key(self):
+        self.assertEqual(self.lispy.eval('(case (+ 1 1) (1 "one") (2 "two"))'), 'two')
+
+    def test_case_string_key(self):
+        self.assertEqual(self.lispy.eval('(case "n" ("y" 1) ("n" 2))'), 2)
+
+    def test_case_symbol_key(self):
+        self.assertEqual(self.lispy.eval('(case (quote bar) (foo 1) (bar 2))'), 2)
+
+    def test_case_key_list(self):
+        self.assertEqual(self.lispy.eval('(case 3 ((1 2) "low") ((3 4) "high"))'), 'high')
+
+    def test_case_default_clause(self):
+        self.assertEqual(self.lispy.eval('(case 5 (1 "one") (t "other"))'), 'other')
+        self.assertEqual(self.lispy.eval('(case 5 (1 "one") (otherwise "other"))'), 'other')
+
+    def test_case_without_matching_clause(self):
+        self.assertEqual(self.lispy.eval('(case 5 (1 "one"))'), Nil())
+
+    def test_case_compares_key_types(self):
+        self.assertEqual(self.lispy.eval('(case 1.0 (1 "integer") (1.0 "float"))'), 'float')
+
+    def test_case_first_clause_wins(self):
+        self.assertEqual(self.lispy.eval('(case 1 (1 "first") (1 "second"))'), 'first')
+
+    def test_case_with_parameter_evaluation(self):
+        self.lispy.eval('(defun name (x) (case x (1 "one") (2 "two")))')
+        self.assertEqual(self.lispy.eval('(name 1)'), 'one')
+        self.assertEqual(self.lispy.eval('(name 2)'), 'two')
+
+    def test_case_with_shared_clauses(self):
+        lispy = Lispy(hash_cons=True)
+        self.assertEqual(lispy.eval('(case 2 (1 "one") (2 "two"))'), 'two')
+        self.assertEqual(lispy.eval('(case 2 (1 "one") (2 "deux"))'), 'deux')
+
+    def test_case_tables_are_bounded(self):
+        self.lispy.interpreter.case_tables.max_size = 10
+
+        for i in range(100):
+            self.assertEqual(self.lispy.eval('(case 1 (1 2) (t 3))'), 2)
+
+        self.assertLessEqual(len(self.lispy.interpreter.case_tables), 10)
+
+    def test_case_table_is_built_once(self):
+        self.lispy.eval('(defun name (x) (case x (1 "one") (2 "two")))')
+        self.lispy.eval('(name 1)')
+        self.lispy.eval('(name 2)')
+        self.assertEqual(len(self.lispy.interpreter.case_tables), 1)
+
     def test_float_type_casting_from_int(self):
         self.assertEqual(self.lispy.eval('(float 10)'), 10.0)
 
@@ -258,6 +341,1362 @@ class TestLispy(unittest.TestCase):
     def test_nested_cons(self):
         self.assertEqual(self.lispy.eval('(cons 1 (cons 2 (cons 3 nil)))'), [1, 2, 3])
 
+    def test_make_hash(self):
+        self.assertEqual(self.lispy.eval('(make-hash)').__class__, HashTable)
+
+    def test_puthash_returns_value(self):
+        self.lispy.eval('(set h (make-hash))')
+        self.assertEqual(self.lispy.eval('(puthash 1 "a" (get h))'), String('a'))
+
+    def test_gethash_with_symbol_key(self):
+        self.lispy.eval('(set h (make-hash))')
+        self.lispy.eval('(puthash (quote foo) 42 (get h))')
+        self.assertEqual(self.lispy.eval('(gethash (quote foo) (get h))'), 42)
+
+    def test_gethash_with_string_key(self):
+        self.lispy.eval('(set h (make-hash))')
+        self.lispy.eval('(puthash "foo" 42 (get h))')
+        self.assertEqual(self.lispy.eval('(gethash (concat "f" "oo") (get h))'), 42)
+
+    def test_gethash_with_list_key(self):
+        self.lispy.eval('(set h (make-hash))')
+        self.lispy.eval('(puthash (quote (1 2)) 42 (get h))')
+        self.assertEqual(self.lispy.eval('(gethash (list 1 2) (get h))'), 42)
+
+    def test_gethash_missing_key(self):
+        self.lispy.eval('(set h (make-hash))')
+        self.assertEqual(self.lispy.eval('(gethash 1 (get h))'), Nil())
+
+    def test_gethash_missing_key_with_default(self):
+        self.lispy.eval('(set h (make-hash))')
+        self.assertEqual(self.lispy.eval('(gethash 1 (get h) 0)'), 0)
+
+    def test_gethash_does_not_mix_symbols_and_strings(self):
+        self.lispy.eval('(set h (make-hash))')
+        self.lispy.eval('(puthash (quote foo) 42 (get h))')
+        self.assertEqual(self.lispy.eval('(gethash "foo" (get h))'), Nil())
+
+    def test_gethash_does_not_mix_numbers_and_t(self):
+        self.lispy.eval('(set h (make-hash))')
+        self.lispy.eval('(puthash 1 "one" (get h))')
+        self.lispy.eval('(puthash t "true" (get h))')
+        self.assertEqual(self.lispy.eval('(hash-count (get h))'), 2)
+        self.assertEqual(self.lispy.eval('(gethash 1 (get h))'), String('one'))
+        self.assertEqual(self.lispy.eval('(gethash t (get h))'), String('true'))
+        self.assertEqual(self.lispy.eval('(gethash 1.0 (get h))'), Nil())
+
+    def test_gethash_does_not_mix_types_inside_lists(self):
+        self.lispy.eval('(set h (make-hash))')
+        self.lispy.eval('(puthash (list 1 (list 2)) "integers" (get h))')
+        self.assertEqual(self.lispy.eval('(gethash (list 1 (list 2.0)) (get h))'), Nil())
+        self.assertEqual(self.lispy.eval('(gethash (list 1 (list 2)) (get h))'), String('integers'))
+
+    def test_remhash_does_not_mix_numbers(self):
+        self.lispy.eval('(set h (make-hash))')
+        self.lispy.eval('(puthash 1 "one" (get h))')
+        self.assertEqual(self.lispy.eval('(remhash 1.0 (get h))'), Nil())
+        self.assertEqual(self.lispy.eval('(hash-keys (get h))'), [1])
+
+    def test_remhash(self):
+        self.lispy.eval('(set h (make-hash))')
+        self.lispy.eval('(puthash 1 2 (get h))')
+        self.assertEqual(self.lispy.eval('(remhash 1 (get h))'), T())
+        self.assertEqual(self.lispy.eval('(remhash 1 (get h))'), Nil())
+        self.assertEqual(self.lispy.eval('(gethash 1 (get h))'), Nil())
+
+    def test_hash_keys(self):
+        self.lispy.eval('(set h (make-hash))')
+        self.lispy.eval('(puthash 1 2 (get h))')
+        self.lispy.eval('(puthash 3 4 (get h))')
+        self.assertEqual(self.lispy.eval('(hash-keys (get h))'), [1, 3])
+
+    def test_hash_keys_empty(self):
+        self.assertEqual(self.lispy.eval('(hash-keys (make-hash))'), Nil())
+
+    def test_hash_count(self):
+        self.lispy.eval('(set h (make-hash))')
+        self.lispy.eval('(puthash 1 2 (get h))')
+        self.lispy.eval('(puthash 1 3 (get h))')
+        self.assertEqual(self.lispy.eval('(hash-count (get h))'), 1)
+
+    def test_hash_tables_are_equal(self):
+        self.lispy.eval('(set first (make-hash))')
+        self.lispy.eval('(set second (make-hash))')
+        self.lispy.eval('(puthash 1 2 (get first))')
+        self.lispy.eval('(puthash 1 2 (get second))')
+        self.assertEqual(self.lispy.eval('(= (get first) (get second))'), T())
+
+    def test_less(self):
+        self.assertEqual(self.lispy.eval('(< 1 2)'), T())
+        self.assertEqual(self.lispy.eval('(< 2 1)'), Nil())
+
+    def test_greater(self):
+        self.assertEqual(self.lispy.eval('(> 2 1.5)'), T())
+        self.assertEqual(self.lispy.eval('(> 1 2)'), Nil())
+
+    def test_less_equal(self):
+        self.assertEqual(self.lispy.eval('(<= 2 2)'), T())
+        self.assertEqual(self.lispy.eval('(<= 3 2)'), Nil())
+
+    def test_greater_equal(self):
+        self.assertEqual(self.lispy.eval('(>= 2 2)'), T())
+        self.assertEqual(self.lispy.eval('(>= 1 2)'), Nil())
+
+    def test_setq_local_variable(self):
+        self.assertEqual(self.lispy.eval('(let ((x 1)) (setq x 2) x)'), 2)
+
+    def test_setq_returns_value(self):
+        self.assertEqual(self.lispy.eval('(let ((x 1)) (setq x (+ x 1)))'), 2)
+
+    def test_setq_updates_innermost_binding(self):
+        self.assertEqual(self.lispy.eval('(let ((x 1)) (let ((x 2)) (setq x 3)) x)'), 1)
+
+    def test_setq_updates_outer_binding(self):
+        self.assertEqual(self.lispy.eval('(let ((x 1)) (let ((y 2)) (setq x 3)) x)'), 3)
+
+    def test_setq_global_variable(self):
+        self.lispy.eval('(setq *foo* 42)')
+        self.assertEqual(self.lispy.eval('(get *foo*)'), 42)
+
+    def test_while(self):
+        self.assertEqual(self.lispy.eval('(let ((i 0)) (while (< i 10) (setq i (+ i 1))) i)'), 10)
+
+    def test_while_returns_nil(self):
+        self.assertEqual(self.lispy.eval('(while nil 1)'), Nil())
+
+    def test_dotimes(self):
+        self.assertEqual(self.lispy.eval('(let ((total 0)) (dotimes (i 5) (setq total (+ total i))) total)'), 10)
+
+    def test_dotimes_with_result(self):
+        self.assertEqual(self.lispy.eval('(dotimes (i 3 i))'), 3)
+
+    def test_dotimes_does_not_leak_variables(self):
+        self.lispy.eval('(dotimes (i 3))')
+        with self.assertRaises(Interpreter.UndefinedSymbolError):
+            self.lispy.eval('(+ i 1)')
+
+    def test_dolist(self):
+        self.assertEqual(self.lispy.eval('(let ((total 0)) (dolist (x (list 1 2 3)) (setq total (+ total x))) total)'), 6)
+
+    def test_dolist_with_result(self):
+        self.assertEqual(self.lispy.eval('(let ((total 0)) (dolist (x (list 1 2 3) total) (setq total (+ total x))))'), 6)
+
+    def test_dolist_with_nil(self):
+        self.assertEqual(self.lispy.eval('(dolist (x nil) 1)'), Nil())
+
+    def test_loops_restore_local_variable_contexts(self):
+        self.lispy.eval('(let ((x 0)) (dotimes (i 3) (dolist (y (list 1 2)) (setq x (+ x y)))))')
+        self.assertEqual(self.lispy.interpreter.local_variable_contexts, [])
+
+    def test_range(self):
+        self.assertEqual(self.lispy.eval('(range 3)').__class__, Stream)
+        self.assertEqual(self.lispy.eval('(to-list (range 3))'), [0, 1, 2])
+
+    def test_range_with_start_and_step(self):
+        self.assertEqual(self.lispy.eval('(to-list (range 1 10 3))'), [1, 4, 7])
+
+    def test_infinite_range(self):
+        self.assertEqual(self.lispy.eval('(to-list (take 3 (range)))'), [0, 1, 2])
+
+    def test_to_list_with_empty_stream(self):
+        self.assertEqual(self.lispy.eval('(to-list (range 0))'), Nil())
+
+    def test_lazy_map(self):
+        self.lispy.eval('(defun double (x) (* x 2))')
+        self.assertEqual(self.lispy.eval('(to-list (lazy-map (quote double) (range 3)))'), [0, 2, 4])
+
+    def test_lazy_map_with_builtin_function(self):
+        self.assertEqual(self.lispy.eval('(to-list (lazy-map (quote str) (list 1 2)))'), ['1', '2'])
+
+    def test_lazy_map_is_lazy(self):
+        self.lispy.eval('(set calls 0)')
+        self.lispy.eval('(defun count (x) (setq calls (+ (get calls) 1)))')
+        self.lispy.eval('(set s (lazy-map (quote count) (range)))')
+        self.assertEqual(self.lispy.eval('(get calls)'), 0)
+        self.lispy.eval('(to-list (take 2 (get s)))')
+        self.assertEqual(self.lispy.eval('(get calls)'), 2)
+
+    def test_lazy_filter(self):
+        self.lispy.eval('(defun small (x) (< x 2))')
+        self.assertEqual(self.lispy.eval('(to-list (lazy-filter (quote small) (range 5)))'), [0, 1])
+
+    def test_take(self):
+        self.assertEqual(self.lispy.eval('(to-list (take 2 (list 1 2 3)))'), [1, 2])
+
+    def test_reduce(self):
+        self.assertEqual(self.lispy.eval('(reduce (quote +) (range 5))'), 10)
+
+    def test_reduce_with_initial_value(self):
+        self.assertEqual(self.lispy.eval('(reduce (quote +) (range 5) 10)'), 20)
+
+    def test_reduce_with_empty_sequence(self):
+        self.assertEqual(self.lispy.eval('(reduce (quote +) nil)'), Nil())
+
+    def test_reduce_with_undefined_function(self):
+        with self.assertRaises(Interpreter.UndefinedFunctionError):
+            self.lispy.eval('(reduce (quote foo) (range 5))')
+
+    def test_reduce_with_special_function(self):
+        with self.assertRaises(Interpreter.UndefinedFunctionError):
+            self.lispy.eval('(reduce (quote if) (range 5))')
+
+    def test_car_with_stream(self):
+        self.assertEqual(self.lispy.eval('(car (range 3 5))'), 3)
+
+    def test_car_with_empty_stream(self):
+        self.assertEqual(self.lispy.eval('(car (range 0))'), Nil())
+
+    def test_cdr_with_stream(self):
+        self.assertEqual(self.lispy.eval('(to-list (cdr (range 3 6)))'), [4, 5])
+
+    def test_cdr_with_one_value_stream(self):
+        self.assertEqual(self.lispy.eval('(cdr (range 1))'), Nil())
+
+    def test_atom_stream(self):
+        self.assertEqual(self.lispy.eval('(atom (range 3))'), Nil())
+
+    def test_dolist_with_stream(self):
+        self.assertEqual(self.lispy.eval('(let ((total 0)) (dolist (x (range 4) total) (setq total (+ total x))))'), 6)
+
+    def test_map_lines(self):
+        self.lispy.eval('(defun shout (line) (concat line "!"))')
+        output = io.StringIO()
+        self.assertEqual(self.lispy.map_lines('shout', io.StringIO('a\nb\n'), output), 2)
+        self.assertEqual(output.getvalue(), 'a!\nb!\n')
+
+    def test_map_lines_without_trailing_new_line(self):
+        self.lispy.eval('(defun shout (line) (concat line "!"))')
+        output = io.StringIO()
+        self.assertEqual(self.lispy.map_lines('shout', io.StringIO('a\nb'), output), 2)
+        self.assertEqual(output.getvalue(), 'a!\nb!\n')
+
+    def test_map_lines_across_chunks(self):
+        self.lispy.eval('(defun shout (line) (concat line "!"))')
+        output = io.StringIO()
+        self.lispy.map_lines('shout', io.StringIO('abc\ndef\n'), output, flush_every=1, chunk_size=2)
+        self.assertEqual(output.getvalue(), 'abc!\ndef!\n')
+
+    def test_map_lines_drops_nil(self):
+        self.lispy.eval('(defun drop-a (line) (if (= line "a") nil line))')
+        output = io.StringIO()
+        self.assertEqual(self.lispy.map_lines('drop-a', io.StringIO('a\nb\na\n'), output), 3)
+        self.assertEqual(output.getvalue(), 'b\n')
+
+    def test_map_lines_with_undefined_function(self):
+        with self.assertRaises(Interpreter.UndefinedFunctionError):
+            self.lispy.map_lines('foo', io.StringIO('a\n'), io.StringIO())
+
+    def test_let_evaluates_values(self):
+        self.assertEqual(self.lispy.eval('(let ((x (+ 1 2))) x)'), 3)
+
+    def test_let_evaluates_values_in_outer_scope(self):
+        self.assertEqual(self.lispy.eval('(let ((x 1)) (let ((x 2) (y x)) y))'), 1)
+
+    def test_lambda(self):
+        self.assertEqual(self.lispy.eval('(lambda (x) x)').__class__, Lambda)
+
+    def test_funcall_lambda(self):
+        self.assertEqual(self.lispy.eval('(funcall (lambda (x y) (+ x y)) 1 2)'), 3)
+
+    def test_funcall_named_function(self):
+        self.lispy.eval('(defun double (x) (* x 2))')
+        self.assertEqual(self.lispy.eval('(funcall (quote double) 2)'), 4)
+
+    def test_lambda_with_multiple_instructions(self):
+        self.assertEqual(self.lispy.eval('(funcall (lambda (x) (setq x (+ x 1)) (* x 2)) 1)'), 4)
+
+    def test_lambda_closure(self):
+        self.lispy.eval('(defun adder (n) (lambda (x) (+ x n)))')
+        self.assertEqual(self.lispy.eval('(funcall (adder 5) 10)'), 15)
+
+    def test_lambda_closure_copies_only_used_variables(self):
+        closure = self.lispy.eval('(let ((a 1) (b 2)) (lambda (x) (+ x a)))')
+        self.assertEqual(closure.value, {Symbol('a'): Integer(1)})
+
+    def test_lambda_closure_ignores_bound_variables(self):
+        closure = self.lispy.eval('(let ((a 1) (b 2) (c 3)) (lambda (a) (let ((b 4)) (+ a b c))))')
+        self.assertEqual(closure.value, {Symbol('c'): Integer(3)})
+
+    def test_lambda_closure_ignores_quoted_symbols(self):
+        closure = self.lispy.eval('(let ((a 1)) (lambda () (quote a)))')
+        self.assertEqual(closure.value, {})
+
+    def test_lambda_does_not_see_caller_variables(self):
+        self.lispy.eval('(set f (lambda () y))')
+        with self.assertRaises(Interpreter.UndefinedSymbolError):
+            self.lispy.eval('(let ((y 1)) (funcall (get f)))')
+
+    def test_lambda_sees_global_variables(self):
+        self.lispy.eval('(set f (lambda () (get y)))')
+        self.lispy.eval('(set y 1)')
+        self.assertEqual(self.lispy.eval('(funcall (get f))'), 1)
+
+    def test_lambda_restores_local_variable_contexts(self):
+        self.assertEqual(self.lispy.eval('(let ((x 1)) (funcall (lambda (y) y) 2) x)'), 1)
+        self.assertEqual(self.lispy.interpreter.local_variable_contexts, [])
+
+    def test_lambda_with_higher_order_functions(self):
+        self.assertEqual(self.lispy.eval('(let ((n 2)) (to-list (lazy-map (lambda (x) (* x n)) (range 3))))'), [0, 2, 4])
+
+    def test_apply(self):
+        self.assertEqual(self.lispy.eval('(apply (quote +) (list 1 2 3))'), 6)
+
+    def test_apply_with_leading_arguments(self):
+        self.assertEqual(self.lispy.eval('(apply (lambda (x y z) (list x y z)) 1 (list 2 3))'), [1, 2, 3])
+
+    def test_map(self):
+        self.assertEqual(self.lispy.eval('(map (lambda (x) (* x x)) (list 1 2 3))'), [1, 4, 9])
+
+    def test_map_with_named_function(self):
+        self.lispy.eval('(defun double (x) (* x 2))')
+        self.assertEqual(self.lispy.eval('(map (quote double) (range 3))'), [0, 2, 4])
+
+    def test_map_with_several_lists(self):
+        self.assertEqual(self.lispy.eval('(map (quote +) (list 1 2 3) (list 10 20))'), [11, 22])
+
+    def test_map_with_empty_list(self):
+        self.assertEqual(self.lispy.eval('(map (quote +) nil)'), Nil())
+
+    def test_filter(self):
+        self.assertEqual(self.lispy.eval('(filter (lambda (x) (> x 1)) (list 1 2 3))'), [2, 3])
+        self.assertEqual(self.lispy.eval('(filter (lambda (x) (> x 5)) (list 1 2 3))'), Nil())
+
+    def test_sort(self):
+        self.assertEqual(self.lispy.eval('(sort (list 3 1 2))'), [1, 2, 3])
+        self.assertEqual(self.lispy.eval('(sort (list "b" "c" "a"))'), ['a', 'b', 'c'])
+        self.assertEqual(self.lispy.eval('(sort nil)'), Nil())
+
+    def test_sort_with_comparator(self):
+        self.assertEqual(self.lispy.eval('(sort (list 3 1 2) (quote >))'), [3, 2, 1])
+        self.lispy.eval('(defun shorter (x y) (< (car x) (car y)))')
+        self.assertEqual(self.lispy.eval('(sort (list (list 2 1) (list 1 2) (list 2 0)) (quote shorter))'),
+                         [[1, 2], [2, 1], [2, 0]])
+
+    def test_length(self):
+        self.assertEqual(self.lispy.eval('(length (list 1 2 3))'), 3)
+        self.assertEqual(self.lispy.eval('(length nil)'), 0)
+        self.assertEqual(self.lispy.eval('(length "abcd")'), 4)
+        self.assertEqual(self.lispy.eval('(length (range 5))'), 5)
+
+    def test_nth(self):
+        self.assertEqual(self.lispy.eval('(nth 1 (list 1 2 3))'), 2)
+        self.assertEqual(self.lispy.eval('(nth 3 (list 1 2 3))'), Nil())
+        self.assertEqual(self.lispy.eval('(nth 2 (range 10))'), 2)
+
+    def test_reverse(self):
+        self.assertEqual(self.lispy.eval('(reverse (list 1 2 3))'), [3, 2, 1])
+        self.assertEqual(self.lispy.eval('(reverse (range 3))'), [2, 1, 0])
+        self.assertEqual(self.lispy.eval('(reverse nil)'), Nil())
+
+    def test_append(self):
+        self.assertEqual(self.lispy.eval('(append (list 1 2) nil (list 3) (range 2))'), [1, 2, 3, 0, 1])
+        self.assertEqual(self.lispy.eval('(append)'), Nil())
+
+    def test_list_functions_respect_list_size_limit(self):
+        with self.assertRaises(Budget.ListSizeLimitExceededError):
+            self.lispy.eval('(map (quote +) (range 1000000000))', max_list_size=100)
+        with self.assertRaises(Budget.ListSizeLimitExceededError):
+            self.lispy.eval('(reverse (range 1000000000))', max_list_size=100)
+
+    def test_split_forms(self):
+        self.assertEqual(list(self.lispy.split_forms('(a (b)) (c)\n(d\n e)')), ['(a (b))', '(c)', '(d e)'])
+
+    def test_split_forms_empty(self):
+        self.assertEqual(list(self.lispy.split_forms('')), [])
+        self.assertEqual(list(self.lispy.split_forms(' \n ')), [])
+
+    def test_split_forms_with_atoms_between_forms(self):
+        self.assertEqual(list(self.lispy.split_forms('x (a) yz (b) w')), ['x', '(a)', 'y', 'z', '(b)', 'w'])
+
+    def test_split_forms_with_unbalanced_parentheses(self):
+        self.assertEqual(list(self.lispy.split_forms('(a))(b)')), ['(a)', ')', '(b)'])
+        self.assertEqual(list(self.lispy.split_forms(')(a)')), [')', '(a)'])
+
+    def test_split_forms_with_unterminated_form(self):
+        self.assertEqual(list(self.lispy.split_forms('(a) (b (c)')), ['(a)', '(b (c)'])
+
+    def test_script_with_unterminated_form(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.lisp') as fd:
+            fd.write('(set x 1)\n(+ 1')
+            fd.flush()
+
+            with self.assertRaises(Lexer.InvalidInputError):
+                self.lispy.execute_script(fd.name)
+
+
+class TestSpecialization(unittest.TestCase):
+    def setUp(self):
+        self.lispy = Lispy()
+        self.lispy.interpreter.specialization_threshold = 3
+        self.lispy.eval('(defun fib (n) (if (< n 2) n (+ (fib (- n 1)) (fib (- n 2)))))')
+
+    def stats(self, name):
+        return self.lispy.interpreter.specialization_stats()[name]
+
+    def test_specialize_after_threshold(self):
+        self.lispy.eval('(fib 1)')
+        self.lispy.eval('(fib 1)')
+        self.assertFalse(self.stats('fib')['specialized'])
+        self.lispy.eval('(fib 1)')
+        self.assertTrue(self.stats('fib')['specialized'])
+
+    def test_specialized_result(self):
+        self.assertEqual(self.lispy.eval('(fib 15)'), 610)
+        self.assertTrue(self.stats('fib')['specialized'])
+        self.assertGreater(self.stats('fib')['specialized_calls'], 0)
+        self.assertEqual(self.stats('fib')['fallbacks'], 0)
+
+    def test_fallback_on_other_argument_types(self):
+        self.lispy.eval('(fib 10)')
+        self.assertEqual(self.lispy.eval('(fib 10.0)'), 55.0)
+        self.assertEqual(self.lispy.eval('(fib 10.0)').__class__, Float)
+        self.assertGreater(self.stats('fib')['fallbacks'], 0)
+
+    def test_fallback_on_operation_types(self):
+        self.lispy.eval('(defun add (x) (+ x (get y)))')
+        self.lispy.eval('(set y 1)')
+        self.lispy.eval('(add 1)')
+        self.lispy.eval('(add 1)')
+        self.lispy.eval('(add 1)')
+        self.lispy.eval('(set y 1.5)')
+        self.assertEqual(self.lispy.eval('(add 1)'), 2.5)
+
+    def test_fallback_when_argument_changes_type(self):
+        self.lispy.eval('(defun change (x) (progn (setq x 1.5) (+ x 1)))')
+        for _ in range(5):
+            self.assertEqual(self.lispy.eval('(change 1)'), 2.5)
+            self.assertEqual(self.lispy.eval('(change 1)').__class__, Float)
+
+    def test_no_specialization_with_multiple_argument_types(self):
+        self.lispy.eval('(fib 1)')
+        self.lispy.eval('(fib 1.0)')
+        self.lispy.eval('(fib 1)')
+        self.assertFalse(self.stats('fib')['specialized'])
+
+    def test_no_specialization_when_disabled(self):
+        self.lispy.interpreter.specialization_threshold = None
+        self.lispy.eval('(fib 10)')
+        self.assertFalse(self.stats('fib')['specialized'])
+
+    def test_specialization_reset_when_builtin_is_redefined(self):
+        self.lispy.eval('(fib 10)')
+        self.lispy.eval('(defun < (x y) nil)')
+        self.assertFalse(self.stats('fib')['specialized'])
+
+    def test_specialized_function_respects_limits(self):
+        self.lispy.eval('(fib 10)')
+        with self.assertRaises(Budget.StepLimitExceededError):
+            self.lispy.eval('(fib 15)', max_steps=100)
+        self.assertEqual(self.lispy.interpreter.local_variable_contexts, [])
+
+
+class TestBudget(unittest.TestCase):
+    def setUp(self):
+        self.lispy = Lispy()
+        self.lispy.eval('(defun forever (n) (forever n))')
+
+    def test_eval_within_limits(self):
+        self.assertEqual(self.lispy.eval('(+ 1 (* 2 3))', max_steps=10, max_depth=10, max_list_size=10, timeout=10), 7)
+
+    def test_step_limit(self):
+        with self.assertRaises(Budget.StepLimitExceededError):
+            self.lispy.eval('(+ 1 (+ 2 (+ 3 4)))', max_steps=2)
+
+    def test_step_limit_in_loop(self):
+        with self.assertRaises(Budget.StepLimitExceededError):
+            self.lispy.eval('(dotimes (i 1000))', max_steps=100)
+
+    def test_depth_limit(self):
+        with self.assertRaises(Budget.DepthLimitExceededError):
+            self.lispy.eval('(forever 1)', max_depth=10)
+
+    def test_depth_limit_on_python_recursion_limit(self):
+        with self.assertRaises(Budget.DepthLimitExceededError):
+            self.lispy.eval('(forever 1)', max_steps=10 ** 9)
+
+    def test_list_size_limit(self):
+        with self.assertRaises(Budget.ListSizeLimitExceededError):
+            self.lispy.eval('(list 1 2 3)', max_list_size=2)
+
+    def test_list_size_limit_with_cons(self):
+        with self.assertRaises(Budget.ListSizeLimitExceededError):
+            self.lispy.eval('(cons 1 (list 2 3))', max_list_size=2)
+
+    def test_list_size_limit_with_infinite_stream(self):
+        with self.assertRaises(Budget.ListSizeLimitExceededError):
+            self.lispy.eval('(to-list (range))', max_list_size=100)
+
+    def test_timeout(self):
+        with self.assertRaises(Budget.TimeoutError):
+            self.lispy.eval('(while t)', timeout=0.01)
+
+    def test_limits_are_lispy_errors(self):
+        with self.assertRaises(LispyError):
+            self.lispy.eval('(while t)', max_steps=100)
+
+    def test_depth_limit_with_lambdas(self):
+        self.lispy.eval('(set f (lambda (g) (funcall g g)))')
+        with self.assertRaises(Budget.DepthLimitExceededError):
+            self.lispy.eval('(funcall (get f) (get f))', max_depth=10)
+        self.assertEqual(self.lispy.interpreter.local_variable_contexts, [])
+        self.assertEqual(self.lispy.interpreter.lambda_depth, 0)
+
+    def test_limits_leave_clean_state(self):
+        with self.assertRaises(Budget.DepthLimitExceededError):
+            self.lispy.eval('(let ((x 1)) (forever 1))', max_depth=10)
+        self.assertEqual(self.lispy.interpreter.local_variable_contexts, [])
+        self.assertIsNone(self.lispy.interpreter.budget)
+
+    def test_limits_apply_to_one_evaluation(self):
+        with self.assertRaises(Budget.StepLimitExceededError):
+            self.lispy.eval('(dotimes (i 1000))', max_steps=100)
+        self.assertEqual(self.lispy.eval('(dotimes (i 1000))'), Nil())
+
+
+class TestTasks(unittest.TestCase):
+    def setUp(self):
+        self.lispy = Lispy()
+
+    def test_spawn(self):
+        self.assertIsInstance(self.lispy.eval('(spawn (lambda () (set x 1)))'), Task)
+        self.lispy.run_tasks()
+        self.assertEqual(self.lispy.eval('(get x)'), Integer(1))
+
+    def test_spawn_with_arguments(self):
+        self.lispy.eval('(defun store (x y) (set z (+ x y)))')
+        self.lispy.eval('(spawn (quote store) 1 2)')
+        self.lispy.run_tasks()
+        self.assertEqual(self.lispy.eval('(get z)'), Integer(3))
+
+    def test_yield_interleaves_tasks(self):
+        self.lispy.eval('(set ch (make-chan))')
+        self.lispy.eval('(defun worker (name) (dotimes (i 2) (send (get ch) name) (yield)))')
+        self.lispy.eval('(spawn (quote worker) 1)')
+        self.lispy.eval('(spawn (quote worker) 2)')
+        self.lispy.run_tasks()
+        self.assertEqual(
+            self.lispy.eval('(list (recv (get ch)) (recv (get ch)) (recv (get ch)) (recv (get ch)))'),
+            List(Integer(1), Integer(2), Integer(1), Integer(2)))
+
+    def test_sleep(self):
+        self.lispy.eval('(set ch (make-chan))')
+        self.lispy.eval('(spawn (lambda () (progn (sleep 0.02) (send (get ch) 1))))')
+        self.lispy.eval('(spawn (lambda () (send (get ch) 2)))')
+        self.assertEqual(self.lispy.eval('(list (recv (get ch)) (recv (get ch)))'), List(Integer(2), Integer(1)))
+
+    def test_sleep_without_tasks(self):
+        self.assertEqual(self.lispy.eval('(sleep 0.001)'), Nil())
+
+    def test_channel(self):
+        self.lispy.eval('(set ch (make-chan))')
+        self.assertEqual(self.lispy.eval('(send (get ch) 1)'), Integer(1))
+        self.assertEqual(self.lispy.eval('(recv (get ch))'), Integer(1))
+
+    def test_send_waits_while_channel_is_full(self):
+        self.lispy.eval('(set ch (make-chan 1))')
+        self.lispy.eval('(set sent 0)')
+        self.lispy.eval('(spawn (lambda () (dotimes (i 3) (send (get ch) i) (set sent (+ (get sent) 1)))))')
+        self.lispy.eval('(yield)')
+        self.assertEqual(self.lispy.eval('(get sent)'), Integer(1))
+        self.assertEqual(self.lispy.eval('(recv (get ch))'), Integer(0))
+        self.assertEqual(self.lispy.eval('(recv (get ch))'), Integer(1))
+        self.assertEqual(self.lispy.eval('(recv (get ch))'), Integer(2))
+        self.lispy.run_tasks()
+        self.assertEqual(self.lispy.eval('(get sent)'), Integer(3))
+
+    def test_tasks_keep_their_local_variables(self):
+        self.lispy.eval('(set ch (make-chan))')
+        self.lispy.eval('(defun worker (x) (progn (yield) (send (get ch) x)))')
+        self.lispy.eval('(spawn (quote worker) 1)')
+        self.lispy.eval('(spawn (quote worker) 2)')
+        self.assertEqual(self.lispy.eval('(let ((x 3)) (list (recv (get ch)) (recv (get ch)) x))'),
+                         List(Integer(1), Integer(2), Integer(3)))
+
+    def test_many_tasks(self):
+        self.lispy.eval('(set ch (make-chan))')
+        self.lispy.eval('(defun worker (x) (progn (yield) (send (get ch) x)))')
+        self.lispy.eval('(dotimes (i 500) (spawn (quote worker) i))')
+        self.assertEqual(
+            self.lispy.eval('(let ((total 0)) (dotimes (i 500 total) (setq total (+ total (recv (get ch))))))'),
+            Integer(sum(range(500))))
+
+    def test_recv_without_tasks_is_deadlock(self):
+        self.lispy.eval('(set ch (make-chan))')
+        with self.assertRaises(Scheduler.DeadlockError):
+            self.lispy.eval('(recv (get ch))')
+
+    def test_recv_with_blocked_tasks_is_deadlock(self):
+        self.lispy.eval('(set ch (make-chan))')
+        self.lispy.eval('(set other (make-chan))')
+        self.lispy.eval('(spawn (lambda () (recv (get other))))')
+        with self.assertRaises(Scheduler.DeadlockError):
+            self.lispy.eval('(recv (get ch))')
+
+    def test_run_tasks_with_blocked_tasks_is_deadlock(self):
+        self.lispy.eval('(set ch (make-chan))')
+        self.lispy.eval('(spawn (lambda () (progn (sleep 0.05) (recv (get ch)))))')
+        self.lispy.eval('(spawn (lambda () (recv (get ch))))')
+        with self.assertRaises(Scheduler.DeadlockError):
+            self.lispy.run_tasks()
+
+    def test_recv_is_not_deadlock_while_a_task_sleeps(self):
+        self.lispy.eval('(set ch (make-chan))')
+        self.lispy.eval('(spawn (lambda () (progn (sleep 0.05) (send (get ch) 1))))')
+        self.assertEqual(self.lispy.eval('(recv (get ch))'), Integer(1))
+
+    def test_sleeping_tasks_do_not_use_the_processor(self):
+        self.lispy.eval('(spawn (lambda () (sleep 0.5)))')
+        start = time.process_time()
+        self.lispy.run_tasks()
+        self.assertLess(time.process_time() - start, 0.25)
+
+    def test_read_does_not_block_other_tasks(self):
+        def slow_input():
+            time.sleep(0.2)
+            return 'x'
+
+        self.lispy.eval('(set ch (make-chan))')
+        self.lispy.eval('(spawn (lambda () (send (get ch) (read))))')
+        self.lispy.eval('(spawn (lambda () (dotimes (i 3) (send (get ch) i))))')
+        with patch('builtins.input', slow_input):
+            self.assertEqual(self.lispy.eval('(list (recv (get ch)) (recv (get ch)) (recv (get ch)) (recv (get ch)))'),
+                             List(Integer(0), Integer(1), Integer(2), String('x')))
+
+    def test_read_line_does_not_block_other_tasks(self):
+        read_fd, write_fd = os.pipe()
+        writer = threading.Timer(0.2, lambda: os.write(write_fd, b'abc\n'))
+        writer.start()
+
+        try:
+            self.lispy.eval('(set ch (make-chan))')
+            self.lispy.eval('(set pipe (open-file "/dev/fd/{}"))'.format(read_fd))
+            self.lispy.eval('(spawn (lambda () (send (get ch) (read-line (get pipe)))))')
+            self.lispy.eval('(spawn (lambda () (send (get ch) 1)))')
+            self.assertEqual(self.lispy.eval('(list (recv (get ch)) (recv (get ch)))'), List(Integer(1), String('abc')))
+        finally:
+            writer.join()
+            self.lispy.eval('(close (get pipe))')
+            os.close(read_fd)
+            os.close(write_fd)
+
+    def test_task_errors_are_raised(self):
+        self.lispy.eval('(spawn (lambda () (undefined)))')
+        with self.assertRaises(Interpreter.UndefinedFunctionError):
+            self.lispy.run_tasks()
+
+    def test_tasks_count_against_step_limit(self):
+        self.lispy.eval('(defun work () (dotimes (i 100000) nil))')
+        with self.assertRaises(Budget.StepLimitExceededError):
+            self.lispy.eval('(progn (spawn (quote work)) (yield) (yield))', max_steps=1000)
+
+    def test_tasks_count_against_timeout(self):
+        self.lispy.eval('(defun spin () (while t nil))')
+        with self.assertRaises(Budget.TimeoutError):
+            self.lispy.eval('(progn (spawn (quote spin)) (yield))', timeout=0.1)
+
+    def test_tasks_without_budget(self):
+        self.lispy.eval('(progn (spawn (lambda () (dotimes (i 2000) nil))) (yield))', max_steps=5000)
+        self.lispy.eval('(spawn (lambda () (dotimes (i 2000) nil)))')
+        self.lispy.run_tasks()
+
+    def test_tasks_of_failed_evaluation_are_cancelled(self):
+        self.lispy.eval('(defun work () (dotimes (i 50) (yield)))')
+        with self.assertRaises(Budget.StepLimitExceededError):
+            self.lispy.eval('(progn (spawn (quote work)) (dotimes (i 1000) nil))', max_steps=100)
+        self.assertEqual(self.lispy.eval('(yield)'), Nil())
+
+    def test_started_tasks_of_failed_evaluation_are_cancelled(self):
+        self.lispy.eval('(set ch (make-chan))')
+        self.lispy.eval('(defun work () (dotimes (i 50) (yield)))')
+        with self.assertRaises(Budget.StepLimitExceededError):
+            self.lispy.eval('(progn (spawn (quote work)) (spawn (lambda () (recv (get ch)))) (yield) (yield) '
+                            '(dotimes (i 1000) nil))', max_steps=100)
+        self.assertEqual(self.lispy.interpreter.scheduler.tasks, {})
+        self.lispy.eval('(spawn (lambda () (send (get ch) 1)))')
+        self.assertEqual(self.lispy.eval('(recv (get ch))'), Integer(1))
+
+    def test_tasks_of_other_evaluations_are_not_cancelled(self):
+        self.lispy.eval('(set ch (make-chan))')
+        self.lispy.eval('(spawn (lambda () (send (get ch) 1)))')
+        with self.assertRaises(Budget.StepLimitExceededError):
+            self.lispy.eval('(dotimes (i 1000) nil)', max_steps=100)
+        self.assertEqual(self.lispy.eval('(recv (get ch))'), Integer(1))
+
+    def test_sleep_stops_at_deadline(self):
+        start = time.monotonic()
+        with self.assertRaises(Budget.TimeoutError):
+            self.lispy.eval('(sleep 100)', timeout=0.1)
+        self.assertLess(time.monotonic() - start, 10)
+
+    def test_task_sleep_stops_at_deadline(self):
+        start = time.monotonic()
+        with self.assertRaises(Budget.TimeoutError):
+            self.lispy.eval('(progn (spawn (lambda () (sleep 100))) (sleep 1))', timeout=0.1)
+        self.assertLess(time.monotonic() - start, 10)
+
+    def test_task_calls_are_recorded_in_metrics(self):
+        lispy = Lispy(metrics=True)
+        lispy.eval('(defun work () nil)')
+        lispy.eval('(progn (spawn (quote work)) (yield))')
+        self.assertEqual(lispy.stats()['user_function_calls'], 1)
+
+
+class TestThreads(unittest.TestCase):
+    def setUp(self):
+        self.lispy = Lispy(output=OutputPort(io.StringIO()))
+
+        # Switch threads as often as possible to interleave evaluations
+        self.switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+
+    def tearDown(self):
+        sys.setswitchinterval(self.switch_interval)
+
+    def run_threads(self, target, count=8):
+        errors = []
+
+        def run(i):
+            try:
+                target(i)
+            except BaseException as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=run, args=[i]) for i in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if errors:
+            raise errors[0]
+
+    def test_local_variables_are_not_shared(self):
+        self.lispy.eval('(defun sum-to (n) (let ((total 0)) (dotimes (i n) (setq total (+ total i))) total))')
+
+        def evaluate(i):
+            for n in range(i, i + 20):
+                self.assertEqual(self.lispy.eval('(let ((total {0})) (+ total (sum-to {0})))'.format(n)), n + n * (n - 1) // 2)
+
+        self.run_threads(evaluate)
+
+    def test_recursion(self):
+        self.lispy.eval('(defun fact (n) (if (<= n 1) 1 (* n (fact (- n 1)))))')
+
+        def evaluate(i):
+            for n in range(i, i + 20):
+                self.assertEqual(self.lispy.eval('(fact {})'.format(n)), math.factorial(n))
+
+        self.run_threads(evaluate)
+
+    def test_lambdas(self):
+        def evaluate(i):
+            for n in range(20):
+                self.assertEqual(self.lispy.eval('(let ((x {})) (funcall (lambda (y) (+ x y)) {}))'.format(i, n)), i + n)
+
+        self.run_threads(evaluate)
+
+    def test_specialization(self):
+        self.lispy.interpreter.specialization_threshold = 10
+        self.lispy.eval('(defun square (x) (* x x))')
+
+        def evaluate(i):
+            for n in range(50):
+                self.assertEqual(self.lispy.eval('(square {})'.format(n)), n * n)
+
+        self.run_threads(evaluate)
+        self.assertTrue(self.lispy.interpreter.specialization_stats()['square']['specialized'])
+
+    def test_global_variables_are_shared(self):
+        def evaluate(i):
+            for n in range(20):
+                self.lispy.eval('(set var-{} {})'.format(i, n))
+
+        self.run_threads(evaluate)
+
+        for i in range(8):
+            self.assertEqual(self.lispy.eval('(get var-{})'.format(i)), 19)
+
+    def test_functions_are_shared(self):
+        def evaluate(i):
+            for n in range(20):
+                self.lispy.eval('(defun fn-{} () {})'.format(i, n))
+
+        self.run_threads(evaluate)
+
+        for i in range(8):
+            self.assertEqual(self.lispy.eval('(fn-{})'.format(i)), 19)
+
+    def test_shared_environment(self):
+        self.lispy.eval('(defun double (x) (* 2 x))')
+        lispy = Lispy(environment=self.lispy.environment())
+
+        def evaluate(i):
+            lispy.eval('(set var-{} (double {}))'.format(i, i))
+
+        self.run_threads(evaluate)
+
+        for i in range(8):
+            self.assertEqual(lispy.eval('(get var-{})'.format(i)), 2 * i)
+
+    def test_budget_is_per_thread(self):
+        self.lispy.eval('(defun loop-forever () (loop-forever))')
+
+        def evaluate(i):
+            if i % 2:
+                with self.assertRaises(Budget.LimitExceededError):
+                    self.lispy.eval('(loop-forever)', max_steps=100)
+            else:
+                self.assertEqual(self.lispy.eval('(let ((x 0)) (dotimes (i 200) (setq x (+ x 1))) x)'), 200)
+
+        self.run_threads(evaluate)
+        self.assertIsNone(self.lispy.interpreter.budget)
+
+    def test_errors_restore_local_variable_contexts(self):
+        def evaluate(i):
+            with self.assertRaises(Interpreter.UndefinedFunctionError):
+                self.lispy.eval('(let ((x {})) (undefined x))'.format(i))
+            self.assertEqual(self.lispy.interpreter.local_variable_contexts, [])
+
+        self.run_threads(evaluate)
+
+    def test_tasks(self):
+        def evaluate(i):
+            self.assertEqual(self.lispy.eval('(let ((ch (make-chan 10))) (spawn (lambda (c) (send c {})) ch) (recv ch))'.format(i)), i)
+            self.lispy.run_tasks()
+
+        self.run_threads(evaluate)
+
+    def test_output(self):
+        output = io.StringIO()
+        lispy = Lispy(output=OutputPort(output, buffer_size=16))
+
+        def evaluate(i):
+            for n in range(20):
+                lispy.eval('(write "line")')
+
+        self.run_threads(evaluate)
+        lispy.interpreter.output.flush()
+        self.assertEqual(output.getvalue(), 'line\n' * 160)
+
+    def test_concatenated_strings(self):
+        self.lispy.eval('(set text (concat "a" "b" "c" "d"))')
+
+        def evaluate(i):
+            self.assertEqual(self.lispy.eval('(get text)').value, 'abcd')
+
+        self.run_threads(evaluate)
+
+
+class TestEnvironment(unittest.TestCase):
+    def setUp(self):
+        library = Lispy()
+        library.eval('(defun double (x) (* x 2))')
+        library.eval('(set limit 10)')
+        library.eval('(set table (make-hash))')
+        library.eval('(puthash 1 2 (get table))')
+        self.library = library
+        self.environment = library.environment()
+
+    def test_builtins_are_shared(self):
+        self.assertIs(Interpreter().functions, Interpreter().functions)
+
+    def test_environment_is_shared(self):
+        first = Lispy(environment=self.environment)
+        second = Lispy(environment=self.environment)
+
+        self.assertIs(first.interpreter.functions, second.interpreter.functions)
+        self.assertEqual(first.eval('(double (get limit))'), Integer(20))
+        self.assertEqual(second.eval('(gethash 1 (get table))'), Integer(2))
+
+    def test_functions_do_not_leak(self):
+        first = Lispy(environment=self.environment)
+        second = Lispy(environment=self.environment)
+        first.eval('(defun double (x) (* x 3))')
+        first.eval('(defun triple (x) (* x 3))')
+
+        self.assertEqual(first.eval('(double 1)'), Integer(3))
+        self.assertEqual(second.eval('(double 1)'), Integer(2))
+        with self.assertRaises(Interpreter.UndefinedFunctionError):
+            second.eval('(triple 1)')
+
+    def test_global_variables_do_not_leak(self):
+        first = Lispy(environment=self.environment)
+        second = Lispy(environment=self.environment)
+        first.eval('(set limit 20)')
+        first.eval('(set other 1)')
+
+        self.assertEqual(first.eval('(get limit)'), Integer(20))
+        self.assertEqual(second.eval('(get limit)'), Integer(10))
+        self.assertNotIn(Symbol('other'), second.interpreter.global_variable_context)
+
+    def test_environment_is_a_snapshot(self):
+        self.library.eval('(defun double (x) (* x 4))')
+        self.library.eval('(puthash 3 4 (get table))')
+        sandbox = Lispy(environment=self.environment)
+
+        self.assertEqual(sandbox.eval('(double 1)'), Integer(2))
+        self.assertEqual(sandbox.eval('(hash-count (get table))'), Integer(1))
+
+    def test_hash_tables_are_read_only(self):
+        sandbox = Lispy(environment=self.environment)
+
+        with self.assertRaises(Interpreter.ReadOnlyError):
+            sandbox.eval('(puthash 3 4 (get table))')
+        with self.assertRaises(Interpreter.ReadOnlyError):
+            sandbox.eval('(remhash 1 (get table))')
+        self.assertEqual(self.library.eval('(puthash 3 4 (get table))'), Integer(4))
+
+    def test_nested_hash_tables_are_read_only(self):
+        self.library.eval('(set tables (list (make-hash)))')
+        sandbox = Lispy(environment=self.library.environment())
+
+        with self.assertRaises(Interpreter.ReadOnlyError):
+            sandbox.eval('(puthash 3 4 (car (get tables)))')
+
+    def test_closed_over_hash_tables_are_read_only(self):
+        self.library.eval('(set pair (let ((tbl (make-hash))) (list (lambda (k v) (puthash k v tbl)) (lambda () (hash-count tbl)))))')
+        environment = self.library.environment()
+        first = Lispy(environment=environment)
+        second = Lispy(environment=environment)
+
+        with self.assertRaises(Interpreter.ReadOnlyError):
+            first.eval('(funcall (car (get pair)) 1 2)')
+        self.assertEqual(second.eval('(funcall (car (cdr (get pair))))'), 0)
+        self.assertEqual(self.library.eval('(funcall (car (get pair)) 1 2)'), 2)
+
+    def test_hash_table_containing_itself(self):
+        self.library.eval('(puthash 3 (get table) (get table))')
+        sandbox = Lispy(environment=self.library.environment())
+
+        self.assertIs(sandbox.eval('(gethash 3 (get table))'), sandbox.eval('(get table)'))
+        with self.assertRaises(Interpreter.ReadOnlyError):
+            sandbox.eval('(puthash 4 5 (gethash 3 (get table)))')
+
+    def test_streams_are_not_shared(self):
+        self.library.eval('(set s (range 10))')
+        with self.assertRaises(Interpreter.UnsharableValueError):
+            self.library.environment()
+
+    def test_values_used_up_by_reading_are_not_shared(self):
+        for value in ('(list (range 10))', '(make-chan)', '(spawn (lambda () nil))', '(let ((f (make-hash))) (puthash 1 (range 1) f) f)'):
+            library = Lispy()
+            library.eval('(set value {})'.format(value))
+            with self.assertRaises(Interpreter.UnsharableValueError):
+                library.environment()
+            library.run_tasks()
+
+    def test_files_are_not_shared(self):
+        self.library.eval('(set file (open-file "{}"))'.format(os.path.abspath(__file__)))
+        try:
+            with self.assertRaises(Interpreter.UnsharableValueError):
+                self.library.environment()
+        finally:
+            self.library.eval('(close (get file))')
+
+    def test_closed_over_streams_are_not_shared(self):
+        self.library.eval('(set next (let ((s (range 10))) (lambda () (take 1 s))))')
+        with self.assertRaises(Interpreter.UnsharableValueError):
+            self.library.environment()
+
+    def test_specialized_functions_are_shared(self):
+        first = Lispy(environment=self.environment)
+        second = Lispy(environment=self.environment)
+        first.interpreter.specialization_threshold = 1
+
+        self.assertEqual(first.eval('(double 2)'), Integer(4))
+        self.assertEqual(second.eval('(double 3)'), Integer(6))
+        self.assertTrue(first.interpreter.specialization_stats()['double']['specialized'])
+
+    def test_redefined_builtins_do_not_leak(self):
+        first = Lispy(environment=self.environment)
+        second = Lispy(environment=self.environment)
+        first.interpreter.specialization_threshold = 1
+        second.interpreter.specialization_threshold = 1
+        second.eval('(double 1)')
+        first.eval('(defun * (x y) 0)')
+
+        self.assertEqual(first.eval('(double 5)'), Integer(0))
+        self.assertEqual(second.eval('(double 5)'), Integer(10))
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.lispy = Lispy(metrics=True)
+
+    def test_disabled_by_default(self):
+        lispy = Lispy()
+        self.assertIsNone(lispy.metrics)
+        self.assertIsNone(lispy.stats())
+
+    def test_stage_counts(self):
+        self.lispy.eval('(+ 1 2)')
+        self.lispy.eval('(+ 1 2)')
+        stats = self.lispy.stats()
+
+        for stage in ('tokenize', 'parse', 'execute'):
+            self.assertEqual(stats['stages'][stage]['count'], 2)
+            self.assertEqual(sum(stats['stages'][stage]['histogram'].values()), 2)
+            self.assertGreaterEqual(stats['stages'][stage]['seconds'], 0)
+
+    def test_forms_and_calls(self):
+        self.lispy.eval('(defun double (x) (* x 2))')
+        self.lispy.eval('(double (double 1))')
+        stats = self.lispy.stats()
+        self.assertEqual(stats['user_function_calls'], 2)
+        self.assertEqual(stats['forms'], 5)
+
+    def test_peak_depth(self):
+        self.lispy.eval('(defun countdown (n) (if (= n 0) 0 (countdown (- n 1))))')
+        self.lispy.eval('(countdown 10)')
+        self.assertEqual(self.lispy.stats()['peak_depth'], 11)
+        self.lispy.eval('(countdown 2)')
+        self.assertEqual(self.lispy.stats()['peak_depth'], 11)
+
+    def test_failed_evaluations_are_counted(self):
+        with self.assertRaises(Interpreter.UndefinedFunctionError):
+            self.lispy.eval('(undefined)')
+        self.assertEqual(self.lispy.stats()['stages']['execute']['count'], 1)
+
+    def test_limits(self):
+        with self.assertRaises(Budget.StepLimitExceededError):
+            self.lispy.eval('(dotimes (i 1000))', max_steps=100)
+        self.assertEqual(self.lispy.stats()['forms'], 101)
+
+    def test_shared_metrics(self):
+        metrics = Metrics()
+        Lispy(metrics=metrics).eval('(+ 1 2)')
+        Lispy(metrics=metrics).eval('(+ 1 2)')
+        self.assertEqual(metrics.counts['execute'], 2)
+
+    def test_export(self):
+        self.lispy.eval('(+ 1 2)')
+        text = self.lispy.metrics.export()
+        self.assertIn('lispy_stage_duration_seconds_bucket{stage="parse",le="+Inf"} 1', text)
+        self.assertIn('lispy_stage_duration_seconds_count{stage="execute"} 1', text)
+        self.assertIn('lispy_forms_evaluated_total 1', text)
+        self.assertIn('lispy_user_function_calls_total 0', text)
+        self.assertIn('lispy_peak_scope_depth 0', text)
+
+    def test_write(self):
+        self.lispy.eval('(+ 1 2)')
+
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'lispy.prom')
+            self.lispy.metrics.write(filename)
+
+            with open(filename) as fd:
+                self.assertEqual(fd.read(), self.lispy.metrics.export())
+            self.assertEqual(os.listdir(directory), ['lispy.prom'])
+
+
+class TestMemory(unittest.TestCase):
+    def setUp(self):
+        self.output = io.StringIO()
+        self.lispy = Lispy(output=OutputPort(self.output))
+        self.lispy.eval('(defun make-row (n) (to-list (range n)))')
+        self.lispy.eval('(defun make-table (n) (let ((rows nil)) (dotimes (i n) (setq rows (cons (make-row 20) rows))) rows))')
+
+    def test_memory_stats_sizes(self):
+        self.lispy.eval('(set x 1)')
+        stats = self.lispy.memory_stats()
+        self.assertEqual(stats['global_variables'], 1)
+        self.assertEqual(stats['user_functions'], 2)
+        self.assertEqual(stats['functions'], len(Interpreter.builtin_functions) + 2)
+
+    def test_memory_stats_counts_live_values(self):
+        self.assertIn('HashTable', self.lispy.memory_stats()['types'])
+        before = self.lispy.memory_stats()['types']['Integer']
+        self.lispy.eval('(set table (make-table 10))')
+        self.assertGreaterEqual(self.lispy.memory_stats()['types']['Integer'] - before, 200)
+
+    def test_memory_stats_builtin(self):
+        self.assertEqual(self.lispy.eval('(gethash (quote user-functions) (memory-stats))'), 2)
+        self.assertEqual(self.lispy.eval('(gethash (quote global-variables) (memory-stats))'), 0)
+        self.assertIsInstance(self.lispy.eval('(gethash (quote Integer) (gethash (quote types) (memory-stats)))'), Integer)
+
+    def test_alloc_trace(self):
+        traces = self.lispy.alloc_trace('(set table (make-table 50)) (+ 1 2)')
+        self.assertEqual([trace['form'] for trace in traces], ['(set table (make-table 50))', '(+ 1 2)'])
+        self.assertEqual(traces[1]['result'], 3)
+        self.assertGreater(traces[0]['size'], traces[1]['size'])
+        self.assertGreaterEqual(traces[0]['peak'], traces[0]['size'])
+        self.assertEqual(traces[0]['sites'], [])
+
+    def test_alloc_trace_sites(self):
+        trace, = self.lispy.alloc_trace('(set table (make-table 50))', sites=1)
+        self.assertEqual(len(trace['sites']), 1)
+        self.assertEqual(trace['sites'][0]['function'], 'make-row')
+        self.assertEqual(trace['sites'][0]['calls'], 50)
+        self.assertGreater(trace['sites'][0]['size'], 0)
+
+    def test_alloc_trace_top_sites(self):
+        trace, = self.lispy.alloc_trace('(make-table 5)', sites=0)
+        self.assertEqual(trace['sites'], [])
+        trace, = self.lispy.alloc_trace('(make-table 5)', sites=10)
+        self.assertEqual(sorted(site['function'] for site in trace['sites']), ['make-row', 'make-table'])
+
+    def test_alloc_trace_stops_tracing(self):
+        self.lispy.alloc_trace('(make-table 5)', sites=10)
+        self.assertFalse(tracemalloc.is_tracing())
+        self.assertIsNone(self.lispy.interpreter.state.allocation_trace)
+
+    def test_alloc_trace_keeps_tracing(self):
+        tracemalloc.start()
+        try:
+            self.lispy.alloc_trace('(make-table 5)')
+            self.assertTrue(tracemalloc.is_tracing())
+        finally:
+            tracemalloc.stop()
+
+    def test_alloc_trace_builtin(self):
+        self.assertEqual(self.lispy.eval('(length (alloc-trace (make-table 5)))'), 5)
+        self.lispy.interpreter.output.flush()
+        self.assertRegex(self.output.getvalue(), r'^-?\d+ bytes retained, \d+ bytes at peak\n$')
+
+    def test_alloc_trace_builtin_sites(self):
+        self.lispy.eval('(alloc-trace (make-table 5) 1)')
+        self.lispy.interpreter.output.flush()
+        lines = self.output.getvalue().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertRegex(lines[1], r'^  make-row: -?\d+ bytes retained in 5 calls$')
+
+    def test_alloc_trace_error(self):
+        with self.assertRaises(Interpreter.UndefinedFunctionError):
+            self.lispy.eval('(alloc-trace (undefined) 1)')
+        self.assertFalse(tracemalloc.is_tracing())
+        self.assertIsNone(self.lispy.interpreter.state.allocation_trace)
+
+
+class TestOutputPort(unittest.TestCase):
+    def test_write_is_buffered(self):
+        sink = io.StringIO()
+        output = OutputPort(sink)
+        output.write('abc')
+        self.assertEqual(sink.getvalue(), '')
+        output.flush()
+        self.assertEqual(sink.getvalue(), 'abc')
+
+    def test_flush_when_buffer_is_full(self):
+        sink = io.StringIO()
+        output = OutputPort(sink, buffer_size=4)
+        output.write('abc')
+        self.assertEqual(sink.getvalue(), '')
+        output.write('def')
+        self.assertEqual(sink.getvalue(), 'abcdef')
+
+    def test_write_through_without_buffer(self):
+        sink = io.StringIO()
+        output = OutputPort(sink, buffer_size=0)
+        output.write('abc')
+        self.assertEqual(sink.getvalue(), 'abc')
+
+    def test_callback_sink(self):
+        chunks = []
+        output = OutputPort(chunks.append)
+        output.write('abc')
+        output.write('def')
+        output.flush()
+        self.assertEqual(chunks, ['abcdef'])
+
+    def test_standard_output_sink(self):
+        output = OutputPort()
+        output.write('abc')
+
+        with patch('sys.stdout', new_callable=io.StringIO) as stdout:
+            output.flush()
+            self.assertEqual(stdout.getvalue(), 'abc')
+
+    def test_write_function(self):
+        sink = io.StringIO()
+        lispy = Lispy(output=OutputPort(sink))
+        lispy.eval('(write "abc")')
+        lispy.eval('(write 1 nil)')
+        lispy.eval('(write-string "def")')
+        lispy.eval('(flush)')
+        self.assertEqual(sink.getvalue(), 'abc\n1def')
+
+    @patch('builtins.input', return_value='abc')
+    def test_read_flushes_output(self, input):
+        sink = io.StringIO()
+        lispy = Lispy(output=OutputPort(sink))
+        lispy.eval('(write "Name: " nil)')
+        lispy.eval('(read)')
+        self.assertEqual(sink.getvalue(), 'Name: ')
+
+
+class TestWatcher(unittest.TestCase):
+    def setUp(self):
+        self.output = io.StringIO()
+        self.lispy = Lispy(output=OutputPort(self.output))
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, 'script.lisp')
+        self.watcher = Watcher(self.lispy, self.filename)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, *forms):
+        with open(self.filename, 'w') as fd:
+            fd.write('\n'.join(forms))
+
+    def lines(self):
+        lines = self.output.getvalue().splitlines()
+        self.output.seek(0)
+        self.output.truncate()
+        return lines
+
+    def test_evaluates_all_forms_first(self):
+        self.write('(defun double (x) (* x 2))', '(write (double 2))')
+        self.assertEqual(self.watcher.update(), 2)
+        self.assertEqual(self.lines(), ['4'])
+
+    def test_unchanged_forms_are_not_evaluated(self):
+        self.write('(defun double (x) (* x 2))', '(write (double 2))', '(write "done")')
+        self.watcher.update()
+        self.lines()
+
+        self.write('(defun double (x) (* x 2))', '(write (double 2))', '(write "finished")')
+        self.assertEqual(self.watcher.update(), 1)
+        self.assertEqual(self.lines(), ['finished'])
+
+    def test_dependents_are_evaluated(self):
+        self.write('(defun double (x) (* x 2))', '(write (double 2))', '(write "done")')
+        self.watcher.update()
+        self.lines()
+
+        self.write('(defun double (x) (* x 3))', '(write (double 2))', '(write "done")')
+        self.assertEqual(self.watcher.update(), 2)
+        self.assertEqual(self.lines(), ['6'])
+
+    def test_transitive_dependents_are_evaluated(self):
+        self.write('(set base 2)', '(defun scale (x) (* x (get base)))', '(set result (scale 5))', '(write (get result))', '(write "done")')
+        self.watcher.update()
+        self.lines()
+
+        self.write('(set base 3)', '(defun scale (x) (* x (get base)))', '(set result (scale 5))', '(write (get result))', '(write "done")')
+        self.assertEqual(self.watcher.update(), 4)
+        self.assertEqual(self.lines(), ['15'])
+
+    def test_removed_definitions(self):
+        self.write('(defun double (x) (* x 2))', '(set limit 10)')
+        self.watcher.update()
+
+        self.write('(set other 10)')
+        self.watcher.update()
+
+        self.assertNotIn(Symbol('double'), self.lispy.interpreter.functions)
+        self.assertNotIn(Symbol('limit'), self.lispy.interpreter.global_variable_context)
+
+    def test_removed_redefinition_of_builtin(self):
+        self.write('(defun car (x) 1)')
+        self.watcher.update()
+        self.write('')
+        self.watcher.update()
+        self.assertEqual(self.lispy.eval('(car (list 2 3))'), Integer(2))
+
+    def test_duplicated_forms(self):
+        self.write('(write "tick")')
+        self.watcher.update()
+        self.lines()
+
+        self.write('(write "tick")', '(write "tick")')
+        self.assertEqual(self.watcher.update(), 1)
+        self.assertEqual(self.lines(), ['tick'])
+
+    def test_errors_do_not_stop_evaluation(self):
+        self.write('(undefined)', '(write "done")')
+
+        with patch('sys.stdout', new=io.StringIO()) as stdout:
+            self.watcher.update()
+
+        self.assertIn('ERROR', stdout.getvalue())
+        self.assertEqual(self.lines(), ['done'])
+
+    def test_poll_only_updates_on_change(self):
+        self.write('(write "tick")')
+        self.assertEqual(self.watcher.poll(), 1)
+        self.assertIsNone(self.watcher.poll())
+
+        self.write('(write "tock")')
+        stat = os.stat(self.filename)
+        os.utime(self.filename, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000))
+        self.assertEqual(self.watcher.poll(), 1)
+        self.assertEqual(self.lines(), ['tick', 'tock'])
+
+
+class TestFiles(unittest.TestCase):
+    def setUp(self):
+        self.lispy = Lispy()
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, 'file.txt')
+
+        with open(self.filename, 'w') as fd:
+            fd.write('abc\ndef\n')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def eval(self, string):
+        return self.lispy.eval(string.replace('FILENAME', '"{}"'.format(self.filename)))
+
+    def test_open_file(self):
+        self.assertEqual(self.eval('(open-file FILENAME)').__class__, File)
+
+    def test_open_missing_file(self):
+        with self.assertRaises(Interpreter.FileError):
+            self.lispy.eval('(open-file "{}")'.format(os.path.join(self.directory.name, 'missing.txt')))
+
+    def test_read_line(self):
+        self.eval('(set f (open-file FILENAME))')
+        self.assertEqual(self.eval('(read-line (get f))'), String('abc'))
+        self.assertEqual(self.eval('(read-line (get f))'), String('def'))
+        self.assertEqual(self.eval('(read-line (get f))'), Nil())
+
+    def test_read_lines(self):
+        self.eval('(set f (open-file FILENAME))')
+        self.assertEqual(self.eval('(read-lines (get f))').__class__, Stream)
+        self.assertEqual(self.eval('(to-list (read-lines (get f)))'), ['abc', 'def'])
+
+    def test_read_lines_after_close(self):
+        with self.assertRaises(Interpreter.FileError):
+            self.eval('(to-list (with-open-file (f FILENAME) (read-lines f)))')
+
+    def test_write_string(self):
+        self.eval('(set f (open-file FILENAME "w"))')
+        self.assertEqual(self.eval('(write-string "abc" (get f))'), Nil())
+        self.eval('(write-line "def" (get f))')
+        self.eval('(close (get f))')
+
+        with open(self.filename) as fd:
+            self.assertEqual(fd.read(), 'abcdef\n')
+
+    def test_close(self):
+        self.eval('(set f (open-file FILENAME))')
+        self.assertEqual(self.eval('(close (get f))'), Nil())
+        with self.assertRaises(Interpreter.FileError):
+            self.eval('(read-line (get f))')
+
+    def test_with_open_file(self):
+        self.assertEqual(self.eval('(with-open-file (f FILENAME) (read-line f))'), String('abc'))
+
+    def test_with_open_file_closes_file(self):
+        self.eval('(with-open-file (f FILENAME) (setq g f))')
+        with self.assertRaises(Interpreter.FileError):
+            self.eval('(read-line (get g))')
+
+    def test_with_open_file_closes_file_on_error(self):
+        with self.assertRaises(Interpreter.UndefinedFunctionError):
+            self.eval('(with-open-file (f FILENAME) (setq g f) (foo))')
+        with self.assertRaises(Interpreter.FileError):
+            self.eval('(read-line (get g))')
+        self.assertEqual(self.lispy.interpreter.local_variable_contexts, [])
+
+    def test_with_open_file_in_write_mode(self):
+        self.eval('(with-open-file (f FILENAME "a") (write-line "ghi" f))')
+
+        with open(self.filename) as fd:
+            self.assertEqual(fd.read(), 'abc\ndef\nghi\n')
+
 
 class TestTypes(unittest.TestCase):
     def test_nil_value(self):
@@ -296,6 +1735,22 @@ class TestTypes(unittest.TestCase):
         with self.assertRaises(TypeError):
             String(1)
 
+    def test_string_concat_value(self):
+        self.assertEqual(String.concat(String('abc'), String('def')), 'abcdef')
+
+    def test_string_concat_nested_value(self):
+        string = String('a')
+        for c in 'bcde':
+            string = String.concat(string, String(c))
+        self.assertEqual(string, 'abcde')
+
+    def test_string_concat_representation(self):
+        self.assertEqual(str(String.concat(String('abc'), String('def'))), 'abcdef')
+
+    def test_string_concat_type_assertion(self):
+        with self.assertRaises(TypeError):
+            String.concat(String('abc'), Integer(1))
+
     def test_symbol_value(self):
         self.assertTrue(Symbol('abc') == Symbol('abc'))
         self.assertFalse(Symbol('abc') != Symbol('abc'))
@@ -340,6 +1795,46 @@ class TestTypes(unittest.TestCase):
         with self.assertRaises(TypeError):
             l[1] = 4
 
+    def test_types_do_not_have_attribute_dictionaries(self):
+        for value in [Nil(), T(), Integer(1), Float(1.0), String('a'), Symbol('a'), List(), HashTable()]:
+            self.assertFalse(hasattr(value, '__dict__'))
+
+    def test_hash_consistent_with_equality(self):
+        self.assertEqual(hash(Integer(1)), hash(Integer(1)))
+        self.assertEqual(hash(String('abc')), hash(String.concat(String('a'), String('bc'))))
+        self.assertEqual(hash(List(Integer(1), Symbol('a'))), hash(List(Integer(1), Symbol('a'))))
+
+    def test_hash_table_value(self):
+        self.assertEqual(HashTable({Integer(1): String('a')}), {1: 'a'})
+
+    def test_hash_table_representation(self):
+        self.assertEqual(str(HashTable({Symbol('a'): Integer(1)})), '#hash((:a 1))')
+
+    def test_hash_table_type_assertion(self):
+        with self.assertRaises(TypeError):
+            HashTable({1: 2})
+
+    def test_stream_iteration(self):
+        self.assertEqual(list(Stream(iter([Integer(1), Integer(2)]))), [1, 2])
+
+    def test_stream_first_and_rest(self):
+        stream = Stream(iter([Integer(1), Integer(2)]))
+        self.assertEqual(stream.first(), 1)
+        self.assertEqual(stream.rest().first(), 2)
+        self.assertEqual(stream.first(), 1)
+        self.assertEqual(list(stream), [1, 2])
+
+    def test_stream_representation(self):
+        self.assertEqual(str(Stream(iter([]))), '#stream')
+
+    def test_stream_type_assertion(self):
+        with self.assertRaises(TypeError):
+            Stream([1, 2])
+
+    def test_hash_table_is_not_hashable(self):
+        with self.assertRaises(TypeError):
+            hash(HashTable())
+
 
 class TestLexer(unittest.TestCase):
     def setUp(self):
@@ -379,6 +1874,20 @@ class TestLexer(unittest.TestCase):
         with self.assertRaises(Lexer.InvalidInputError):
             self.lexer.tokenize('(1')
 
+    def test_tokenize_ignores_input_after_list(self):
+        self.assertEqual(self.lexer.tokenize('(1 2) (3)'), ['1', '2'])
+
+    def test_tokenize_literal_with_parentheses(self):
+        self.assertEqual(self.lexer.tokenize('(write "(a b)")'), ['write', '"(a b)"'])
+
+    def test_tokenize_deeply_nested_lists(self):
+        depth = 10 * sys.getrecursionlimit()
+        tokens = self.lexer.tokenize('(' * depth + '1' + ')' * depth)
+
+        for _ in range(depth - 1):
+            tokens, = tokens
+        self.assertEqual(tokens, ['1'])
+
 
 class TestParser(unittest.TestCase):
     def setUp(self):
@@ -463,6 +1972,124 @@ class TestParser(unittest.TestCase):
         self.assert_float(result[2][1][2])
         self.assert_string(result[2][2])
 
+    def test_compact_parser_shares_atoms(self):
+        parser = Parser(compact=True)
+        result = parser.parse(['foo', '1', ['foo', '1', '"abc"'], '"abc"'])
+
+        self.assertIs(result[1], result[2][1])
+        self.assertIs(result[3], result[2][2])
+        self.assertIs(result[0], result[2][0])
+
+    def test_compact_parser_keeps_types(self):
+        parser = Parser(compact=True)
+        result = parser.parse(['foo', '1', '1.0', 'nil'])
+
+        self.assert_integer(result[1])
+        self.assert_float(result[2])
+        self.assert_nil(result[3])
+
+    def test_compact_parser_is_executed(self):
+        lispy = Lispy()
+        lispy.parser = Parser(compact=True)
+        self.assertEqual(lispy.eval('(let ((x 1)) (- (- x) (- 1)))'), 0)
+        self.assertEqual(lispy.eval('(- 1)'), -1)
+
+    def test_compact_lispy(self):
+        lispy = Lispy(compact=True)
+        self.assertTrue(lispy.parser.compact)
+        self.assertFalse(lispy.parser.hash_cons)
+        self.assertEqual(lispy.eval('(list 1 1.0 "a")'), [1, 1.0, 'a'])
+        result = lispy.parser.parse(['foo', ['foo']])
+        self.assertIs(result[0], result[1][0])
+
+
+    def test_parse_deeply_nested_lists(self):
+        depth = 10 * sys.getrecursionlimit()
+        tokens = ['1']
+        for _ in range(depth - 1):
+            tokens = [tokens, []]
+
+        result = self.parser.parse(tokens)
+
+        for _ in range(depth - 1):
+            self.assert_nil(result[1])
+            result = result[0]
+        self.assertEqual(result, List(Integer(1)))
+
+    def test_hash_consing_parser_shares_lists(self):
+        parser = Parser(hash_cons=True)
+        result = parser.parse([['a', ['1', '2']], ['a', ['1', '2']], ['1', '2']])
+
+        self.assertIs(result[0], result[1])
+        self.assertIs(result[0][1], result[2])
+        self.assertIs(parser.parse([['1', '2']])[0], result[2])
+
+    def test_hash_consing_parser_keeps_types(self):
+        parser = Parser(hash_cons=True)
+        result = parser.parse([['1'], ['1.0'], ['"a"'], ['a']])
+
+        self.assertEqual(len({id(element) for element in result}), 4)
+        self.assert_integer(result[0][0])
+        self.assert_float(result[1][0])
+        self.assert_string(result[2][0])
+        self.assertEqual(result[3][0].__class__, Symbol)
+
+    def test_hash_consing_parser_keeps_nested_types(self):
+        parser = Parser(hash_cons=True)
+        result = parser.parse([[['t']], [['1']], [['1.0']]])
+
+        self.assertEqual(len({id(element) for element in result}), 3)
+        self.assertEqual(result[0][0][0].__class__, T)
+        self.assert_integer(result[1][0][0])
+        self.assert_float(result[2][0][0])
+
+    def test_hash_consing_keeps_nested_types_when_evaluated(self):
+        lispy = Lispy(hash_cons=True)
+        self.assertEqual(repr(lispy.eval('(quote ((t)))')), '((t))')
+        self.assertEqual(repr(lispy.eval('(quote ((1)))')), '((1))')
+        lispy.eval('(defun f (x) (list (+ x 1)))')
+        lispy.eval('(defun h (x) (list (+ x 1.0)))')
+        self.assert_float(lispy.eval('(h 1)')[0])
+
+    def test_hash_consing_pool_is_bounded(self):
+        parser = Parser(hash_cons=True)
+        parser.lists.max_size = parser.constants.max_size = 10
+
+        for i in range(100):
+            parser.parse([str(i), [str(i)]])
+
+        self.assertLessEqual(len(parser.lists), 10)
+        self.assertLessEqual(len(parser.constants), 10)
+        self.assertEqual(parser.parse(['1', '2']), List(Integer(1), Integer(2)))
+
+    def test_hash_consed_lists(self):
+        parser = Parser(hash_cons=True)
+        result = parser.parse([['1', '2'], ['1', '3'], ['1.0', '2']])
+
+        self.assertEqual(result[0], List(Integer(1), Integer(2)))
+        self.assertEqual(List(Integer(1), Integer(2)), result[0])
+        self.assertNotEqual(result[0], result[1])
+        self.assertEqual(result[0], result[2])
+        self.assertEqual(hash(result[0]), hash(List(Integer(1), Integer(2))))
+        self.assertEqual({result[0]: 1}[List(Integer(1), Integer(2))], 1)
+
+    def test_hash_consed_lists_are_immutable(self):
+        result = Parser(hash_cons=True).parse(['1', '2'])
+
+        with self.assertRaises(TypeError):
+            result[0] = Integer(3)
+
+    def test_hash_consing_parser_is_executed(self):
+        lispy = Lispy(hash_cons=True)
+        lispy.eval('(defun f (x) (if (= x (quote (1 2))) (quote (1 2)) nil))')
+        self.assertEqual(lispy.eval('(f (quote (1 2)))'), List(Integer(1), Integer(2)))
+        self.assertEqual(lispy.eval('(f (list 1 2))'), List(Integer(1), Integer(2)))
+        self.assertEqual(lispy.eval('(f (quote (1 3)))'), Nil())
+        lispy.eval('(set table (make-hash))')
+        lispy.eval('(puthash (quote (1 2)) 3 (get table))')
+        self.assertEqual(lispy.eval('(gethash (quote (1 2)) (get table))'), Integer(3))
+        self.assertEqual(lispy.eval('(gethash (list 1 2) (get table))'), Integer(3))
+
 
 class TestInterpreter(unittest.TestCase):
     def setUp(self):